@@ -1,27 +1,37 @@
 """
 Conversation management and context handling.
 """
-from typing import List, Dict, Any, Optional
+import asyncio
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, List, Dict, Any, Optional
 import structlog
 from bson import ObjectId
 
+from app.clock import coarse_utcnow
 from app.models.conversation import Conversation, Message, MessageType, MessageStatus
+from app.models.user import User
 from app.ai.models import model_manager
+from app.realtime import realtime, chat_channel
 
 logger = structlog.get_logger()
 
+# Maximum number of conversations whose context is kept in memory
+CONTEXT_CACHE_SIZE = 1000
+
 
 class ConversationManager:
     """Manages conversation flow and context."""
     
     def __init__(self):
-        self.active_conversations: Dict[str, Dict] = {}
+        # LRU of conversation_id -> {"lock": Lock, "messages": deque | None}
+        self.active_conversations: "OrderedDict[str, Dict]" = OrderedDict()
     
     async def process_user_message(
         self, 
         conversation_id: ObjectId, 
         user_message: str,
-        user_id: ObjectId
+        user_id: ObjectId,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
         """
         Process a user message and generate an AI response.
@@ -30,6 +40,7 @@ class ConversationManager:
             conversation_id: The conversation ID
             user_message: The user's message content
             user_id: The user ID
+            on_chunk: If given, awaited with each response chunk as it streams
             
         Returns:
             Dictionary containing the AI response and metadata
@@ -40,42 +51,93 @@ class ConversationManager:
                 conversation_id, user_id
             )
             
-            # Save user message
-            user_msg = await conversation.add_message(
-                content=user_message,
-                message_type=MessageType.USER
-            )
-            
-            # Create pending AI message
-            ai_msg = await conversation.add_message(
-                content="",
-                message_type=MessageType.ASSISTANT,
-                status=MessageStatus.PROCESSING
-            )
-            
-            # Get conversation history for context
-            conversation_history = await self._get_conversation_context(conversation)
-            
-            # Generate AI response
-            response_text, metadata = await model_manager.generate_response(
-                conversation_history=conversation_history,
-                max_tokens=conversation.model_config.get("max_tokens"),
-                temperature=conversation.model_config.get("temperature")
-            )
-            
-            # Update AI message with response
-            ai_msg.content = response_text
-            ai_msg.status = MessageStatus.COMPLETED
-            ai_msg.model_used = metadata.get("model_used")
-            ai_msg.confidence_score = metadata.get("confidence_score")
-            ai_msg.processing_time = metadata.get("processing_time")
-            ai_msg.metadata = metadata
-            
-            await ai_msg.save()
+            # Serialize turns per conversation so cached context stays ordered
+            entry = self._context_entry(str(conversation.id))
+            async with entry["lock"]:
+                # Save user message
+                user_msg = await conversation.add_message(
+                    content=user_message,
+                    message_type=MessageType.USER,
+                    token_count=await model_manager.count_message_tokens(
+                        "user", user_message
+                    )
+                )
+                
+                # Context history: loaded once, then kept in memory
+                if entry["messages"] is None:
+                    entry["messages"] = deque(
+                        await self._get_conversation_context(conversation),
+                        maxlen=conversation.context_window
+                    )
+                else:
+                    entry["messages"].append(self._context_item(user_msg))
+                conversation_history = list(entry["messages"])
+                
+                # Generate AI response
+                config = conversation.generation_config
+                generation_kwargs = {
+                    "conversation_history": conversation_history,
+                    "max_tokens": config.get("max_tokens"),
+                    "temperature": config.get("temperature")
+                }
+                if on_chunk is None:
+                    generated = await model_manager.generate_response(
+                        **generation_kwargs
+                    )
+                    response_text, metadata = generated
+                else:
+                    # Only the final concatenated response is persisted
+                    metadata = {}
+                    chunks = []
+                    async for chunk in model_manager.generate_response_stream(
+                        metadata=metadata, **generation_kwargs
+                    ):
+                        chunks.append(chunk)
+                        await on_chunk(chunk)
+                    response_text = "".join(chunks).strip()
+                
+                # Persist the AI message only once there is a response
+                ai_msg = Message(
+                    conversation_id=conversation.id,
+                    user_id=conversation.user_id,
+                    conversation_title=conversation.title,
+                    content=response_text,
+                    message_type=MessageType.ASSISTANT,
+                    status=MessageStatus.COMPLETED,
+                    model_used=metadata.get("model_used"),
+                    confidence_score=metadata.get("confidence_score"),
+                    processing_time=metadata.get("processing_time"),
+                    token_count=await model_manager.count_message_tokens(
+                        "assistant", response_text
+                    ),
+                    metadata=metadata
+                )
+                
+                # Insert the message and update conversation stats concurrently
+                stored_conversation = Conversation.find_one(
+                    Conversation.id == conversation.id
+                )
+                await asyncio.gather(
+                    ai_msg.insert(),
+                    stored_conversation.update({
+                        "$inc": {
+                            "message_count": 1,
+                            "total_tokens_used": metadata.get("tokens_used", 0)
+                        },
+                        "$set": {"updated_at": coarse_utcnow()}
+                    }),
+                    User.increment_stats(conversation.user_id, messages=1)
+                )
+                entry["messages"].append(self._context_item(ai_msg))
             
-            # Update conversation stats
-            conversation.total_tokens_used += metadata.get("tokens_used", 0)
-            await conversation.save()
+            # Let the user's other connections, on any worker, see the new turn
+            await realtime.publish(chat_channel(str(user_id)), {
+                "type": "ai_response",
+                "conversation_id": str(conversation.id),
+                "user_message_id": str(user_msg.id),
+                "message_id": str(ai_msg.id),
+                "content": response_text
+            })
             
             logger.info(
                 "Processed user message",
@@ -100,13 +162,6 @@ class ConversationManager:
                 conversation_id=str(conversation_id),
                 user_id=str(user_id)
             )
-            
-            # Update AI message status to failed if it exists
-            if 'ai_msg' in locals():
-                ai_msg.status = MessageStatus.FAILED
-                ai_msg.metadata = {"error": str(e)}
-                await ai_msg.save()
-            
             raise
     
     async def _get_or_create_conversation(
@@ -124,12 +179,12 @@ class ConversationManager:
         conversation = Conversation(
             user_id=user_id,
             title="New Conversation",
-            model_config={
+            generation_config={
                 "max_tokens": 512,
                 "temperature": 0.7
             }
         )
-        await conversation.insert()
+        await conversation.insert_with_stats()
         
         logger.info(
             "Created new conversation",
@@ -142,54 +197,85 @@ class ConversationManager:
     async def _get_conversation_context(
         self, 
         conversation: Conversation
-    ) -> List[Dict[str, str]]:
+    ) -> List[Dict[str, Any]]:
         """Get conversation history formatted for the AI model."""
-        messages = await conversation.get_messages(
+        return await conversation.get_context_messages(
             limit=conversation.context_window
         )
+    
+    @staticmethod
+    def _context_item(message: Message) -> Dict[str, Any]:
+        """Format a single message for the AI model."""
+        is_user = message.message_type == MessageType.USER
+        return {
+            "role": "user" if is_user else "assistant",
+            "content": message.content,
+            "token_count": message.token_count
+        }
+    
+    def _context_entry(self, conversation_id: str) -> Dict:
+        """Get a conversation's cached context entry, creating it if needed."""
+        entry = self.active_conversations.get(conversation_id)
+        if entry is not None:
+            self.active_conversations.move_to_end(conversation_id)
+            return entry
         
-        # Reverse to get chronological order
-        messages.reverse()
-        
-        context = []
-        for message in messages:
-            if message.status == MessageStatus.COMPLETED:
-                role = "user" if message.message_type == MessageType.USER else "assistant"
-                context.append({
-                    "role": role,
-                    "content": message.content
-                })
-        
-        return context
+        entry = {"lock": asyncio.Lock(), "messages": None}
+        self.active_conversations[conversation_id] = entry
+        while len(self.active_conversations) > CONTEXT_CACHE_SIZE:
+            self.active_conversations.popitem(last=False)
+        return entry
+    
+    def forget_conversation(self, conversation_id: str):
+        """Drop cached context for a conversation."""
+        self.active_conversations.pop(conversation_id, None)
     
     async def get_conversation_summary(
         self, 
         conversation_id: ObjectId
     ) -> Dict[str, Any]:
         """Get a summary of the conversation."""
-        conversation = await Conversation.get(conversation_id)
-        if not conversation:
+        # Join the latest messages, already trimmed, in the same round trip
+        own_messages = {"$expr": {"$eq": ["$conversation_id", "$$cid"]}}
+        preview = {"$concat": [{"$substrCP": ["$content", 0, 100]}, "..."]}
+        summaries = await Conversation.aggregate([
+            {"$match": {"_id": conversation_id}},
+            {"$lookup": {
+                "from": Message.Settings.name,
+                "let": {"cid": "$_id"},
+                "pipeline": [
+                    {"$match": own_messages},
+                    {"$sort": {"timestamp": -1}},
+                    {"$limit": 5},
+                    {"$project": {
+                        "_id": 0,
+                        "id": {"$toString": "$_id"},
+                        "content": {"$cond": [
+                            {"$gt": [{"$strLenCP": "$content"}, 100]},
+                            preview,
+                            "$content"
+                        ]},
+                        "type": "$message_type",
+                        "timestamp": 1
+                    }}
+                ],
+                "as": "recent_messages"
+            }},
+            {"$project": {
+                "_id": 0,
+                "conversation_id": {"$toString": "$_id"},
+                "title": 1,
+                "status": 1,
+                "message_count": 1,
+                "created_at": 1,
+                "updated_at": 1,
+                "recent_messages": 1
+            }}
+        ]).to_list(1)
+        if not summaries:
             raise ValueError("Conversation not found")
         
-        messages = await conversation.get_messages(limit=10)
-        
-        return {
-            "conversation_id": str(conversation.id),
-            "title": conversation.title,
-            "status": conversation.status,
-            "message_count": conversation.message_count,
-            "created_at": conversation.created_at,
-            "updated_at": conversation.updated_at,
-            "recent_messages": [
-                {
-                    "id": str(msg.id),
-                    "content": msg.content[:100] + "..." if len(msg.content) > 100 else msg.content,
-                    "type": msg.message_type,
-                    "timestamp": msg.timestamp
-                }
-                for msg in messages[:5]
-            ]
-        }
+        return summaries[0]
     
     async def update_conversation_title(
         self, 
@@ -203,6 +289,7 @@ class ConversationManager:
                 conversation.title = title
                 conversation.update_timestamp()
                 await conversation.save()
+                await conversation.sync_message_titles()
                 return True
             return False
         except Exception as e:
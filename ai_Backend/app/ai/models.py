@@ -1,15 +1,23 @@
 """
 AI model management and inference.
 """
+import asyncio
+import contextlib
+import functools
+import hashlib
+import importlib.util
 import os
 import time
-from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+import numpy as np
 import torch
 from transformers import (
     AutoTokenizer, 
     AutoModelForCausalLM, 
-    ConversationPipeline,
-    pipeline
+    BitsAndBytesConfig,
+    TextStreamer
 )
 from sentence_transformers import SentenceTransformer
 import structlog
@@ -18,6 +26,55 @@ from app.config import settings
 
 logger = structlog.get_logger()
 
+# Let the Rust tokenizer backend use its own thread pool
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+# Single worker so model calls never contend for the same device queue
+_INFERENCE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="inference"
+)
+
+# Sentence embedding model used for semantic search
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Maximum number of queued texts encoded in a single forward pass
+EMBEDDING_MAX_BATCH = 64
+
+# Number of embeddings kept in the content-hash LRU cache (~15 MB at 384 dims)
+EMBEDDING_CACHE_SIZE = 10_000
+
+# Prompt lengths used to prime kernels and the compile cache before serving
+# traffic
+WARMUP_INPUT_LENGTHS = (32, 128, 512)
+
+# Tokens held back from the prompt budget for the trailing "Assistant: " cue
+PROMPT_SAFETY_TOKENS = 8
+
+# Smallest prompt budget, so a large max_tokens can never squeeze out the
+# user's message
+MIN_PROMPT_TOKENS = 64
+
+# Prompt prefix for each conversation role
+ROLE_PREFIXES = {"user": "Human: ", "assistant": "Assistant: "}
+
+
+class _AsyncTextStreamer(TextStreamer):
+    """Forwards text decoded on the inference thread to an asyncio queue."""
+    
+    def __init__(
+        self,
+        tokenizer,
+        loop: asyncio.AbstractEventLoop,
+        queue: asyncio.Queue
+    ):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.loop = loop
+        self.queue = queue
+    
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+
 
 class ModelManager:
     """Manages AI models and inference."""
@@ -26,14 +83,38 @@ class ModelManager:
         self.conversation_model = None
         self.tokenizer = None
         self.embedding_model = None
-        self.conversation_pipeline = None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         
+        # Prefer BF16 on GPUs that support it for numerically stable sampling
+        if self.device == "cuda":
+            self.dtype = (
+                torch.bfloat16 if torch.cuda.is_bf16_supported()
+                else torch.float16
+            )
+        else:
+            self.dtype = torch.float32
+        
+        # Micro-batching queue for embedding requests
+        self._embed_queue: Optional[asyncio.Queue] = None
+        self._embed_worker_task: Optional[asyncio.Task] = None
+        
+        # LRU cache of embeddings keyed by a digest of the text
+        self._embedding_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        
+        # Reusable pinned host buffers for tokenizer output, one per input
+        # name, and the event marking when the last copy out of them finished
+        # (CUDA only)
+        self._pinned_staging: Dict[str, torch.Tensor] = {}
+        self._staging_copied: Optional[torch.cuda.Event] = None
+        
     async def initialize_models(self):
         """Initialize all AI models."""
         logger.info("Initializing AI models", device=self.device)
         
         try:
+            if self.device == "cuda":
+                self._configure_cuda_backends()
+            
             # Create model cache directory
             os.makedirs(settings.model_cache_dir, exist_ok=True)
             
@@ -42,6 +123,11 @@ class ModelManager:
             
             # Load embedding model for semantic search
             await self._load_embedding_model()
+            self._start_embed_worker()
+            
+            # Pay compilation and kernel selection cost before the first
+            # request, on the same thread that will serve inference
+            await self._run_inference(self._warmup_models)
             
             logger.info("All AI models initialized successfully")
             
@@ -49,41 +135,187 @@ class ModelManager:
             logger.error("Failed to initialize AI models", error=str(e))
             raise
     
+    def _configure_cuda_backends(self):
+        """Enable autotuned kernels and TF32 tensor-core math on CUDA."""
+        torch.backends.cudnn.benchmark = True
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.set_float32_matmul_precision("high")
+    
     async def _load_conversation_model(self):
         """Load the conversational AI model."""
         logger.info("Loading conversation model", model=settings.default_model)
         
         self.tokenizer = AutoTokenizer.from_pretrained(
-            settings.default_model,
-            cache_dir=settings.model_cache_dir
-        )
-        
-        self.conversation_model = AutoModelForCausalLM.from_pretrained(
             settings.default_model,
             cache_dir=settings.model_cache_dir,
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-            device_map="auto" if self.device == "cuda" else None
-        )
-        
-        # Create conversation pipeline
-        self.conversation_pipeline = ConversationPipeline(
-            model=self.conversation_model,
-            tokenizer=self.tokenizer,
-            device=0 if self.device == "cuda" else -1
+            use_fast=True,
+            padding_side="left"
         )
         
         # Add padding token if not present
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
+        
+        # Keep the most recent turns when a prompt has to be truncated
+        self.tokenizer.truncation_side = "left"
+        
+        load_kwargs = {
+            "cache_dir": settings.model_cache_dir,
+            "torch_dtype": self.dtype,
+            "device_map": "auto" if self.device == "cuda" else None,
+        }
+        
+        # 8/4-bit weights on CUDA are handled by bitsandbytes at load time
+        quantize_cuda = (
+            self.device == "cuda"
+            and settings.quantization in ("int8", "int4")
+        )
+        if quantize_cuda:
+            load_kwargs.pop("torch_dtype")
+            load_kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_8bit=settings.quantization == "int8",
+                load_in_4bit=settings.quantization == "int4",
+                bnb_4bit_compute_dtype=self.dtype
+            )
+        
+        attn_implementation = self._attention_implementation()
+        
+        try:
+            self.conversation_model = AutoModelForCausalLM.from_pretrained(
+                settings.default_model,
+                attn_implementation=attn_implementation,
+                **load_kwargs
+            )
+        except ValueError as e:
+            # Not every architecture ships a fused attention kernel
+            logger.warning(
+                "Fused attention unavailable, using eager attention",
+                attn_implementation=attn_implementation,
+                error=str(e)
+            )
+            self.conversation_model = AutoModelForCausalLM.from_pretrained(
+                settings.default_model,
+                **load_kwargs
+            )
+        
+        self.conversation_model.config.use_cache = True
+        self._freeze(self.conversation_model)
+        
+        if self.device == "cpu" and settings.quantization:
+            self._quantize_for_cpu()
+        
+        # Compile the forward pass; generate() itself has dynamic control flow
+        compile_model = settings.compile_model and not quantize_cuda
+        if self.device == "cuda" and compile_model:
+            self.conversation_model.forward = torch.compile(
+                self.conversation_model.forward,
+                mode="reduce-overhead",
+                fullgraph=False
+            )
+    
+    @staticmethod
+    def _freeze(model: torch.nn.Module):
+        """Put a model in inference mode: no dropout, no gradient tracking."""
+        model.eval()
+        for parameter in model.parameters():
+            parameter.requires_grad_(False)
+    
+    def _quantize_for_cpu(self):
+        """Apply dynamic INT8 quantization to the linear layers on CPU."""
+        if settings.quantization != "int8":
+            logger.warning(
+                "Quantization mode not supported on CPU, keeping FP32",
+                quantization=settings.quantization
+            )
+            return
+        
+        self.conversation_model = torch.quantization.quantize_dynamic(
+            self.conversation_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        
+        # Quantized kernels are compute-bound on CPU, so use every core
+        torch.set_num_threads(os.cpu_count() or 1)
+        logger.info("Conversation model quantized to INT8 for CPU inference")
+    
+    def _attention_implementation(self) -> str:
+        """Pick the fastest attention kernel available on this device."""
+        has_flash_attn = importlib.util.find_spec("flash_attn") is not None
+        if self.device == "cuda" and has_flash_attn:
+            return "flash_attention_2"
+        return "sdpa"
     
     async def _load_embedding_model(self):
         """Load the sentence embedding model."""
-        logger.info("Loading embedding model")
+        logger.info(
+            "Loading embedding model", backend=settings.embedding_backend
+        )
+        
+        # Cached vectors belong to the previous model
+        self._embedding_cache.clear()
+        
+        if settings.embedding_backend == "onnx":
+            from app.ai.onnx_embeddings import ONNXEmbeddingModel
+            
+            self.embedding_model = ONNXEmbeddingModel(
+                EMBEDDING_MODEL,
+                cache_dir=settings.model_cache_dir,
+                device=self.device
+            )
+            return
         
         self.embedding_model = SentenceTransformer(
-            'all-MiniLM-L6-v2',
+            EMBEDDING_MODEL,
             cache_folder=settings.model_cache_dir
         )
+        self.embedding_model = self.embedding_model.to(self.device)
+        self._freeze(self.embedding_model)
+        
+        # Half precision halves memory traffic on GPU; CPU stays in FP32
+        if self.device == "cuda" and settings.embedding_fp16:
+            self.embedding_model.half()
+    
+    def _autocast(self):
+        """Mixed-precision context for inference on CUDA; a no-op on CPU."""
+        if self.device == "cuda":
+            return torch.autocast(device_type="cuda", dtype=self.dtype)
+        return contextlib.nullcontext()
+    
+    def _warmup_models(self):
+        """Run representative inputs so the first request is not cold."""
+        start_time = time.time()
+        
+        self.embedding_model.encode(
+            ["hello world"] * 4,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        embedding_time = time.time() - start_time
+        
+        device = self.conversation_model.device
+        max_input_length = self.tokenizer.model_max_length - 8
+        
+        with torch.inference_mode(), self._autocast():
+            for input_length in WARMUP_INPUT_LENGTHS:
+                input_ids = torch.full(
+                    (1, min(input_length, max_input_length)),
+                    self.tokenizer.eos_token_id,
+                    dtype=torch.long,
+                    device=device
+                )
+                self.conversation_model.generate(
+                    input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    max_new_tokens=8,
+                    do_sample=False,
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
+        
+        logger.info(
+            "AI models warmed up",
+            embedding_warmup_time=embedding_time,
+            total_warmup_time=time.time() - start_time
+        )
     
     async def generate_response(
         self, 
@@ -109,73 +341,292 @@ class ModelManager:
             max_tokens = max_tokens or settings.max_tokens
             temperature = temperature or settings.temperature
             
-            # Format conversation for the model
-            formatted_conversation = self._format_conversation(conversation_history)
-            
-            # Generate response
-            response = self.conversation_pipeline(
-                formatted_conversation,
-                max_length=max_tokens,
-                temperature=temperature,
-                do_sample=True,
-                pad_token_id=self.tokenizer.eos_token_id
+            # Format the prompt and run the forward passes off the event loop
+            result = await self._run_inference(
+                self._generate_sync,
+                conversation_history,
+                max_tokens,
+                temperature
             )
+            generated_text, input_length, output_length = result
             
-            # Extract the generated text
-            generated_text = response.generated_responses[-1]
-            
-            processing_time = time.time() - start_time
-            
-            # Calculate confidence score (simplified)
-            confidence_score = self._calculate_confidence(generated_text)
+            metadata = self._response_metadata(
+                generated_text, start_time, max_tokens, temperature,
+                input_length + output_length
+            )
+            return generated_text, metadata
             
-            metadata = {
-                "model_used": settings.default_model,
-                "processing_time": processing_time,
-                "confidence_score": confidence_score,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "device": self.device
-            }
+        except Exception as e:
+            logger.error("Failed to generate response", error=str(e))
+            raise
+    
+    async def generate_response_stream(
+        self, 
+        conversation_history: List[Dict[str, str]], 
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Generate a response, yielding decoded text chunks as they are produced.
+        
+        Args:
+            conversation_history: List of messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature
+            metadata: Filled with the generation metadata once the stream ends
+        """
+        start_time = time.time()
+        
+        try:
+            max_tokens = max_tokens or settings.max_tokens
+            temperature = temperature or settings.temperature
             
-            logger.info(
-                "Generated response",
-                processing_time=processing_time,
-                confidence_score=confidence_score,
-                response_length=len(generated_text)
+            # The inference thread hands text to the loop; None marks the end
+            chunks: asyncio.Queue = asyncio.Queue()
+            streamer = _AsyncTextStreamer(
+                self.tokenizer, asyncio.get_running_loop(), chunks
             )
+            generation = asyncio.ensure_future(self._run_inference(
+                self._generate_sync,
+                conversation_history,
+                max_tokens,
+                temperature,
+                streamer=streamer
+            ))
+            generation.add_done_callback(lambda _: chunks.put_nowait(None))
             
-            return generated_text, metadata
+            while (chunk := await chunks.get()) is not None:
+                yield chunk
+            
+            generated_text, input_length, output_length = await generation
+            if metadata is not None:
+                metadata.update(self._response_metadata(
+                    generated_text, start_time, max_tokens, temperature,
+                    input_length + output_length
+                ))
             
         except Exception as e:
-            logger.error("Failed to generate response", error=str(e))
+            logger.error("Failed to stream response", error=str(e))
             raise
     
-    def _format_conversation(self, conversation_history: List[Dict[str, str]]) -> str:
-        """Format conversation history for the model."""
-        formatted = ""
-        for message in conversation_history[-settings.max_tokens//50:]:  # Limit context
+    def _response_metadata(
+        self,
+        generated_text: str,
+        start_time: float,
+        max_tokens: int,
+        temperature: float,
+        tokens_used: int
+    ) -> Dict[str, Any]:
+        """Build (and log) the metadata attached to a generated response."""
+        processing_time = time.time() - start_time
+        
+        # Calculate confidence score (simplified)
+        confidence_score = self._calculate_confidence(generated_text)
+        
+        logger.info(
+            "Generated response",
+            processing_time=processing_time,
+            confidence_score=confidence_score,
+            response_length=len(generated_text)
+        )
+        
+        return {
+            "model_used": settings.default_model,
+            "processing_time": processing_time,
+            "confidence_score": confidence_score,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "tokens_used": tokens_used,
+            "device": self.device
+        }
+    
+    async def _run_inference(self, func, *args, **kwargs):
+        """Run a blocking model call on the inference executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _INFERENCE_EXECUTOR, functools.partial(func, *args, **kwargs)
+        )
+    
+    def _generate_sync(
+        self, 
+        conversation_history: List[Dict[str, Any]], 
+        max_tokens: int, 
+        temperature: float,
+        streamer: Optional[TextStreamer] = None
+    ) -> Tuple[str, int, int]:
+        """
+        Format the prompt, then tokenize, generate and decode a reply.
+        
+        Blocks the calling thread.
+        """
+        prompt = self._format_conversation(conversation_history, max_tokens)
+        
+        # Tokenize, capped at the prompt budget plus the cue's reserve
+        inputs = self.tokenizer(
+            prompt,
+            return_tensors="pt",
+            truncation=True,
+            max_length=self._prompt_budget(max_tokens) + PROMPT_SAFETY_TOKENS
+        )
+        input_length = inputs["input_ids"].shape[1]
+        
+        device = self.conversation_model.device
+        if device.type == "cuda":
+            inputs = self._stage_inputs(inputs, device)
+        else:
+            inputs = inputs.to(device)
+        
+        # Generate response
+        with torch.inference_mode(), self._autocast():
+            output_ids = self.conversation_model.generate(
+                **inputs,
+                max_new_tokens=max_tokens,
+                temperature=temperature,
+                do_sample=True,
+                pad_token_id=self.tokenizer.eos_token_id,
+                use_cache=True,
+                streamer=streamer
+            )
+        
+        # Decode only the newly generated tokens
+        generated_ids = output_ids[0, input_length:]
+        generated_text = self.tokenizer.decode(
+            generated_ids, skip_special_tokens=True
+        ).strip()
+        
+        return generated_text, input_length, len(generated_ids)
+    
+    def _stage_inputs(
+        self, inputs, device: torch.device
+    ) -> Dict[str, torch.Tensor]:
+        """Copy tokenizer output to the GPU through reusable pinned buffers."""
+        # Pinned memory lets the copy run as an async DMA transfer, but pinning
+        # is expensive, so the buffers are allocated once at model_max_length
+        # and reused
+        if self._staging_copied is not None:
+            # The previous request's copy may still be reading the buffers
+            self._staging_copied.synchronize()
+        
+        staged = {}
+        for name, tensor in inputs.items():
+            size = tensor.numel()
+            buffer = self._pinned_staging.get(name)
+            reusable = (
+                buffer is not None
+                and buffer.dtype == tensor.dtype
+                and buffer.numel() >= size
+            )
+            if not reusable:
+                buffer = torch.empty(
+                    max(size, self.tokenizer.model_max_length),
+                    dtype=tensor.dtype,
+                    pin_memory=True
+                )
+                self._pinned_staging[name] = buffer
+            
+            host_view = buffer[:size].view(tensor.shape)
+            host_view.copy_(tensor)
+            staged[name] = host_view.to(device, non_blocking=True)
+        
+        self._staging_copied = torch.cuda.Event()
+        self._staging_copied.record()
+        return staged
+    
+    def _format_message(self, role: str, content: str) -> Optional[str]:
+        """Format a single message as a prompt line."""
+        prefix = ROLE_PREFIXES.get(role)
+        if prefix is None:
+            return None
+        return prefix + content + "\n"
+    
+    async def count_message_tokens(
+        self, role: str, content: str
+    ) -> Optional[int]:
+        """Count a message's prompt tokens, if the tokenizer is loaded."""
+        line = self._format_message(role, content)
+        if self.tokenizer is None or line is None:
+            return None
+        # Off the event loop, on the default pool so it never queues behind
+        # generation
+        loop = asyncio.get_running_loop()
+        encode = functools.partial(
+            self.tokenizer.encode, line, add_special_tokens=False
+        )
+        token_ids = await loop.run_in_executor(None, encode)
+        return len(token_ids)
+    
+    def _prompt_budget(self, max_tokens: int) -> int:
+        """Tokens available to conversation history, leaving room to reply."""
+        reserved = max_tokens + PROMPT_SAFETY_TOKENS
+        return max(
+            self.tokenizer.model_max_length - reserved, MIN_PROMPT_TOKENS
+        )
+    
+    def _truncate_line(self, role: str, content: str, limit: int) -> str:
+        """Format a message, keeping only its content's last `limit` tokens."""
+        prefix = ROLE_PREFIXES[role]
+        overhead = len(
+            self.tokenizer.encode(prefix + "\n", add_special_tokens=False)
+        )
+        content_ids = self.tokenizer.encode(content, add_special_tokens=False)
+        kept_ids = content_ids[-max(limit - overhead, 1):]
+        return prefix + self.tokenizer.decode(kept_ids) + "\n"
+    
+    def _format_conversation(
+        self, 
+        conversation_history: List[Dict[str, Any]], 
+        max_tokens: int
+    ) -> str:
+        """
+        Format the most recent conversation history that fits the context.
+        
+        Tokenizes messages without a stored token_count, so call it off the
+        event loop.
+        """
+        budget = self._prompt_budget(max_tokens)
+        
+        # Walk backwards from the newest message until the budget is spent
+        lines = []
+        used_tokens = 0
+        for message in reversed(conversation_history):
             role = message.get("role", "user")
             content = message.get("content", "")
             
-            if role == "user":
-                formatted += f"Human: {content}\n"
-            elif role == "assistant":
-                formatted += f"Assistant: {content}\n"
+            line = self._format_message(role, content)
+            if line is None:
+                continue
+            
+            token_count = message.get("token_count")
+            if token_count is None:
+                token_count = len(
+                    self.tokenizer.encode(line, add_special_tokens=False)
+                )
+            
+            if used_tokens + token_count > budget:
+                # Never drop the newest message: left-truncate it to the
+                # budget instead
+                if not lines:
+                    lines.append(self._truncate_line(role, content, budget))
+                break
+            used_tokens += token_count
+            lines.append(line)
         
-        formatted += "Assistant: "
-        return formatted
+        lines.reverse()
+        lines.append(ROLE_PREFIXES["assistant"])
+        return "".join(lines)
     
     def _calculate_confidence(self, text: str) -> float:
         """Calculate a simple confidence score for the generated text."""
         # This is a simplified confidence calculation
         # In practice, you might use model logits or other metrics
         
-        if not text or len(text.strip()) < 5:
+        # Generated text is already stripped, so no copy is needed here
+        if len(text) < 5:
             return 0.1
         
-        # Basic heuristics
-        word_count = len(text.split())
+        # Basic heuristics; counting separators avoids building a word list
+        word_count = text.count(" ") + 1
         if word_count < 3:
             return 0.3
         elif word_count > 100:
@@ -183,29 +634,194 @@ class ModelManager:
         else:
             return min(0.9, 0.4 + (word_count / 100) * 0.5)
     
-    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Get sentence embeddings for semantic search."""
+    def _start_embed_worker(self):
+        """Start the background embedding worker if it is not running."""
+        if self._embed_worker_task is None or self._embed_worker_task.done():
+            self._embed_queue = asyncio.Queue()
+            self._embed_worker_task = asyncio.create_task(self._embed_worker())
+    
+    async def _embed_worker(self):
+        """Drain queued embedding requests into batched encode calls."""
+        queue = self._embed_queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < EMBEDDING_MAX_BATCH:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = await self._run_inference(
+                    self.embedding_model.encode,
+                    texts,
+                    batch_size=EMBEDDING_MAX_BATCH,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                )
+                embeddings = self._quantize_embeddings(embeddings)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+    
+    @staticmethod
+    def _embedding_cache_key(text: str) -> bytes:
+        """Digest used to key the embedding cache."""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    
+    @staticmethod
+    def _quantize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+        """Store normalized embeddings in the configured precision."""
+        precision = settings.embedding_precision
+        if precision == "binary":
+            # One bit per dimension: the sign of each component
+            return np.packbits(embeddings > 0, axis=-1)
+        if precision == "int8":
+            # Normalized components lie in [-1, 1], so a fixed scale needs no
+            # calibration
+            return np.round(embeddings * 127).astype(np.int8)
+        if precision == "float16":
+            return embeddings.astype(np.float16)
+        return embeddings.astype(np.float32, copy=False)
+    
+    @staticmethod
+    def _embedding_similarity(
+        emb_a: np.ndarray, emb_b: np.ndarray
+    ) -> np.ndarray:
+        """Cosine similarity matrix for embeddings in the set precision."""
+        precision = settings.embedding_precision
+        if precision == "binary":
+            # Hamming distance maps to [-1, 1]: identical bits score 1
+            dimensions = emb_a.shape[-1] * 8
+            differing = np.unpackbits(
+                np.bitwise_xor(emb_a[:, None, :], emb_b[None, :, :]), axis=-1
+            ).sum(axis=-1)
+            return (1.0 - 2.0 * differing / dimensions).astype(np.float32)
+        if precision == "int8":
+            scores = emb_a.astype(np.int32) @ emb_b.astype(np.int32).T
+            return (scores / (127.0 * 127.0)).astype(np.float32)
+        emb_a = emb_a.astype(np.float32, copy=False)
+        emb_b = emb_b.astype(np.float32, copy=False)
+        return emb_a @ emb_b.T
+    
+    async def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Get normalized embeddings in ``settings.embedding_precision``.
+        
+        Float precisions return an ``(n, dim)`` array, ``int8`` scales
+        components by 127 and ``binary`` packs one sign bit per dimension.
+        """
+        if not texts:
+            return np.empty((0, 0))
+        
         try:
-            embeddings = self.embedding_model.encode(texts, convert_to_tensor=False)
-            return embeddings.tolist()
+            keys = [self._embedding_cache_key(text) for text in texts]
+            
+            # Resolve cache hits up front; queue one encode per distinct miss
+            resolved = {}
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key in resolved or key in missing:
+                    continue
+                if key in self._embedding_cache:
+                    self._embedding_cache.move_to_end(key)
+                    resolved[key] = self._embedding_cache[key]
+                else:
+                    missing[key] = text
+            
+            if missing:
+                self._start_embed_worker()
+                loop = asyncio.get_running_loop()
+                
+                futures = []
+                for text in missing.values():
+                    future = loop.create_future()
+                    self._embed_queue.put_nowait((text, future))
+                    futures.append(future)
+                
+                encoded = await asyncio.gather(*futures)
+                for key, embedding in zip(missing, encoded):
+                    resolved[key] = embedding
+                    self._embedding_cache[key] = embedding
+                
+                while len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+                    self._embedding_cache.popitem(last=False)
+            
+            return np.stack([resolved[key] for key in keys])
         except Exception as e:
             logger.error("Failed to generate embeddings", error=str(e))
             raise
     
+    def _encode_normalized(self, texts: List[str]) -> torch.Tensor:
+        """Encode texts into L2-normalized float32 tensors on the device."""
+        embeddings = self.embedding_model.encode(
+            texts,
+            batch_size=EMBEDDING_MAX_BATCH,
+            convert_to_tensor=True,
+            normalize_embeddings=True,
+            device=self.device
+        )
+        return embeddings.float()
+    
     async def semantic_similarity(self, text1: str, text2: str) -> float:
         """Calculate semantic similarity between two texts."""
         try:
-            embeddings = await self.get_embeddings([text1, text2])
-            
-            # Calculate cosine similarity
-            import numpy as np
-            emb1, emb2 = np.array(embeddings[0]), np.array(embeddings[1])
-            similarity = np.dot(emb1, emb2) / (np.linalg.norm(emb1) * np.linalg.norm(emb2))
+            embeddings = await self._run_inference(
+                self._encode_normalized, [text1, text2]
+            )
             
-            return float(similarity)
+            # Embeddings are L2-normalized, so cosine similarity is a dot
+            # product
+            return float((embeddings[0] * embeddings[1]).sum().item())
         except Exception as e:
             logger.error("Failed to calculate similarity", error=str(e))
             return 0.0
+    
+    async def semantic_similarity_batch(
+        self, 
+        pairs: List[Tuple[str, str]]
+    ) -> List[float]:
+        """Calculate semantic similarity for many text pairs at once."""
+        if not pairs:
+            return []
+        
+        try:
+            # Encode every distinct text exactly once
+            unique_texts = list(
+                dict.fromkeys(text for pair in pairs for text in pair)
+            )
+            index = {text: i for i, text in enumerate(unique_texts)}
+            
+            embeddings = await self._run_inference(
+                self._encode_normalized, unique_texts
+            )
+            
+            left = embeddings[[index[a] for a, _ in pairs]]
+            right = embeddings[[index[b] for _, b in pairs]]
+            return (left * right).sum(dim=1).tolist()
+        except Exception as e:
+            logger.error("Failed to calculate batch similarity", error=str(e))
+            return [0.0] * len(pairs)
+    
+    async def semantic_similarity_matrix(
+        self, 
+        texts_a: List[str], 
+        texts_b: List[str]
+    ) -> np.ndarray:
+        """Cosine similarity between each of ``texts_a`` and ``texts_b``."""
+        if not texts_a or not texts_b:
+            return np.empty((len(texts_a), len(texts_b)), dtype=np.float32)
+        
+        # One cached, batched encode for both sides, then a single GEMM
+        embeddings = await self.get_embeddings(texts_a + texts_b)
+        emb_a, emb_b = embeddings[:len(texts_a)], embeddings[len(texts_a):]
+        return self._embedding_similarity(emb_a, emb_b)
 
 
 # Global model manager instance
@@ -0,0 +1,115 @@
+"""
+ONNX Runtime backend for the sentence embedding model.
+"""
+import os
+from typing import List, Optional, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import AutoTokenizer
+import structlog
+
+logger = structlog.get_logger()
+
+
+class ONNXEmbeddingModel:
+    """Mean-pooled sentence encoder served by ONNX Runtime.
+    
+    Mirrors the subset of ``SentenceTransformer.encode`` used by the
+    model manager so the two backends are interchangeable.
+    """
+    
+    max_seq_length = 256
+    
+    def __init__(self, model_name: str, cache_dir: str, device: str):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        
+        self.device = device
+        provider = (
+            "CUDAExecutionProvider" if device == "cuda"
+            else "CPUExecutionProvider"
+        )
+        export_dir = os.path.join(
+            cache_dir, "onnx", model_name.replace("/", "--")
+        )
+        file_name = "model_quantized.onnx" if device == "cpu" else "model.onnx"
+        
+        if not os.path.exists(os.path.join(export_dir, file_name)):
+            self._export(model_name, cache_dir, export_dir)
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            export_dir,
+            file_name=file_name,
+            provider=provider
+        )
+    
+    def _export(self, model_name: str, cache_dir: str, export_dir: str):
+        """Export the model to ONNX once and cache it on disk."""
+        from optimum.onnxruntime import (
+            ORTModelForFeatureExtraction, ORTQuantizer
+        )
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        
+        logger.info(
+            "Exporting embedding model to ONNX",
+            model=model_name,
+            path=export_dir
+        )
+        
+        model = ORTModelForFeatureExtraction.from_pretrained(
+            model_name,
+            export=True,
+            cache_dir=cache_dir
+        )
+        model.save_pretrained(export_dir)
+        tokenizer = AutoTokenizer.from_pretrained(
+            model_name, cache_dir=cache_dir
+        )
+        tokenizer.save_pretrained(export_dir)
+        
+        # Dynamic INT8 weights for CPU inference
+        if self.device == "cpu":
+            quantizer = ORTQuantizer.from_pretrained(model)
+            quantization_config = AutoQuantizationConfig.avx2(is_static=False)
+            quantizer.quantize(
+                save_dir=export_dir,
+                quantization_config=quantization_config
+            )
+    
+    def encode(
+        self,
+        sentences: List[str],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        convert_to_tensor: bool = False,
+        normalize_embeddings: bool = False,
+        device: Optional[str] = None,
+        **kwargs
+    ) -> Union[np.ndarray, torch.Tensor]:
+        """Encode sentences into mean-pooled embeddings."""
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            features = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="pt"
+            ).to(self.model.device)
+            
+            token_embeddings = self.model(**features).last_hidden_state
+            mask = features["attention_mask"].unsqueeze(-1)
+            mask = mask.to(token_embeddings.dtype)
+            summed = (token_embeddings * mask).sum(dim=1)
+            pooled = summed / mask.sum(dim=1).clamp(min=1e-9)
+            
+            if normalize_embeddings:
+                pooled = F.normalize(pooled, p=2, dim=1)
+            batches.append(pooled)
+        
+        embeddings = torch.cat(batches)
+        if convert_to_tensor:
+            return embeddings.to(device or self.device)
+        return embeddings.cpu().numpy()
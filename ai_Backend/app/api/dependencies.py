@@ -1,7 +1,13 @@
 """
 API dependencies for authentication and database access.
 """
-from typing import Optional
+import asyncio
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
@@ -10,35 +16,108 @@ from bson import ObjectId
 from app.config import settings
 from app.models.user import User
 from app.database import get_database
+from app.realtime import realtime, USER_INVALIDATION_CHANNEL
 
 security = HTTPBearer()
 
+# Users resolved from recently seen tokens, so most requests skip the Mongo
+# lookup
+USER_CACHE_SIZE = 10_000
+USER_CACHE_TTL = 60  # seconds
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-) -> User:
-    """Get the current authenticated user."""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+# token digest -> (monotonic expiry, user), least recently used first
+_user_cache: "OrderedDict[bytes, Tuple[float, User]]" = OrderedDict()
+
+_OBJECT_ID_RE = re.compile(r"[0-9a-fA-F]{24}")
+
+
+def _token_key(token: str) -> bytes:
+    """Compact cache key for a bearer token."""
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+async def authenticate_token(token: str) -> Optional[User]:
+    """Resolve a JWT to its user, or None if it is invalid or revoked."""
+    key = _token_key(token)
+    cached = _user_cache.get(key)
+    if cached is not None:
+        expires_at, user = cached
+        if time.monotonic() < expires_at:
+            _user_cache.move_to_end(key)
+            # Handlers update the user they are given, so never hand out the
+            # cached instance itself
+            return user.model_copy(deep=True)
+        del _user_cache[key]
     
     try:
         payload = jwt.decode(
-            credentials.credentials, 
-            settings.secret_key, 
-            algorithms=[settings.algorithm]
+            token, settings.secret_key, algorithms=[settings.algorithm]
         )
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        return None
+    
+    user_id: str = payload.get("sub")
+    if user_id is None:
+        return None
     
     user = await User.get(ObjectId(user_id))
+    # Tokens issued before the last password change carry an older version
+    if user is None or payload.get("ver", 0) != user.token_version:
+        return None
+    
+    # Never keep a user cached past the token's own expiry
+    ttl = USER_CACHE_TTL
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - time.time())
+    _user_cache[key] = (time.monotonic() + ttl, user.model_copy(deep=True))
+    if len(_user_cache) > USER_CACHE_SIZE:
+        _user_cache.popitem(last=False)
+    
+    return user
+
+
+def forget_user_tokens(user_id: ObjectId):
+    """Drop every token of a user cached by this process."""
+    stale = [
+        key for key, (_, user) in _user_cache.items() if user.id == user_id
+    ]
+    for key in stale:
+        del _user_cache[key]
+
+
+async def invalidate_cached_user(user_id: ObjectId):
+    """Drop a user's cached tokens in this and every other worker."""
+    forget_user_tokens(user_id)
+    # Without Redis, other workers keep serving the stale user for at most
+    # USER_CACHE_TTL
+    await realtime.publish(
+        USER_INVALIDATION_CHANNEL, {"user_id": str(user_id)}
+    )
+
+
+async def _on_user_invalidated(payload: dict):
+    """Apply a user cache invalidation published by any worker."""
+    forget_user_tokens(ObjectId(payload["user_id"]))
+
+
+async def subscribe_user_invalidations() -> Optional[asyncio.Task]:
+    """Start applying user cache invalidations from other workers."""
+    return await realtime.subscribe(
+        _on_user_invalidated, USER_INVALIDATION_CHANNEL
+    )
+
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> User:
+    """Get the current authenticated user."""
+    user = await authenticate_token(credentials.credentials)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     
     if not user.is_active:
         raise HTTPException(
@@ -61,12 +140,20 @@ async def get_current_active_user(
     return current_user
 
 
+@lru_cache(maxsize=4096)
+def _parse_object_id(id_str: str) -> Optional[ObjectId]:
+    """Parse a hex ObjectId string, or None if it is malformed."""
+    if not _OBJECT_ID_RE.fullmatch(id_str):
+        return None
+    return ObjectId(id_str)
+
+
 def get_object_id(id_str: str) -> ObjectId:
     """Convert string ID to ObjectId with validation."""
-    try:
-        return ObjectId(id_str)
-    except Exception:
+    object_id = _parse_object_id(id_str)
+    if object_id is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid ID format"
         )
+    return object_id
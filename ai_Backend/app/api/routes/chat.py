@@ -1,34 +1,48 @@
 """
 Chat API endpoints for conversational AI functionality.
 """
+import asyncio
 from typing import Optional, List
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from pydantic import BaseModel, Field, TypeAdapter
 from bson import ObjectId
 
 from app.models.user import User
 from app.models.conversation import (
-    Conversation, Message, MessageCreate, MessageResponse,
-    ConversationCreate, ConversationResponse, MessageType
+    Conversation, Message, MessageCreate,
+    ConversationCreate, ConversationResponse, ConversationStatus, MessageType,
+    ConversationListProjection, MessageBriefProjection, API_SCHEMA_CONFIG,
+    PyObjectId, encode_message_cursor, parse_message_cursor
 )
-from app.api.dependencies import get_current_active_user, get_object_id
+from app.api.dependencies import get_current_active_user
 from app.ai.conversation_manager import conversation_manager
+from app.security import security_middleware
 import structlog
 
 logger = structlog.get_logger()
 
 router = APIRouter()
 
+# Serializers for read paths that return pre-encoded JSON
+_conversation_adapter = TypeAdapter(ConversationResponse)
+_conversation_list_adapter = TypeAdapter(List[ConversationResponse])
+
 
 class ChatRequest(BaseModel):
     """Request model for chat messages."""
+    model_config = API_SCHEMA_CONFIG
+    
     message: str
-    conversation_id: Optional[str] = None
-    model_config: Optional[dict] = None
+    conversation_id: Optional[PyObjectId] = None
+    generation_config: Optional[dict] = Field(
+        default=None, alias="model_config"
+    )
 
 
 class ChatResponse(BaseModel):
     """Response model for chat messages."""
+    model_config = API_SCHEMA_CONFIG
+    
     conversation_id: str
     user_message_id: str
     ai_message_id: str
@@ -36,17 +50,18 @@ class ChatResponse(BaseModel):
     metadata: dict
 
 
-@router.post("/chat", response_model=ChatResponse)
+@router.post(
+    "/chat",
+    response_model=ChatResponse,
+    dependencies=[Depends(security_middleware.check_chat_rate_limit)]
+)
 async def send_message(
     request: ChatRequest,
     current_user: User = Depends(get_current_active_user)
 ):
     """Send a message and get AI response."""
     try:
-        # Convert conversation_id if provided
-        conversation_id = None
-        if request.conversation_id:
-            conversation_id = get_object_id(request.conversation_id)
+        conversation_id = request.conversation_id
         
         # Process the message
         result = await conversation_manager.process_user_message(
@@ -81,14 +96,22 @@ async def get_conversations(
     try:
         conversations = await Conversation.find(
             Conversation.user_id == current_user.id
-        ).sort(-Conversation.updated_at).skip(offset).limit(limit).to_list()
-        
-        result = []
-        for conv in conversations:
-            # Get recent messages
-            recent_messages = await conv.get_messages(limit=3)
-            
-            result.append(ConversationResponse(
+        ).sort(-Conversation.updated_at).skip(offset).limit(limit).project(
+            ConversationListProjection
+        ).to_list()
+        
+        # Fetch recent messages for all conversations concurrently; a failure
+        # cancels the rest
+        async with asyncio.TaskGroup() as tg:
+            recent_tasks = [
+                tg.create_task(Message.recent(
+                    conv.id, limit=3, projection=MessageBriefProjection
+                ))
+                for conv in conversations
+            ]
+        
+        result = [
+            ConversationResponse.model_construct(
                 id=str(conv.id),
                 user_id=str(conv.user_id),
                 title=conv.title,
@@ -96,21 +119,15 @@ async def get_conversations(
                 created_at=conv.created_at,
                 updated_at=conv.updated_at,
                 message_count=conv.message_count,
-                recent_messages=[
-                    MessageResponse(
-                        id=str(msg.id),
-                        conversation_id=str(msg.conversation_id),
-                        content=msg.content,
-                        message_type=msg.message_type,
-                        status=msg.status,
-                        timestamp=msg.timestamp,
-                        confidence_score=msg.confidence_score
-                    )
-                    for msg in recent_messages
-                ]
-            ))
+                recent_messages=[msg.to_response() for msg in task.result()]
+            )
+            for conv, task in zip(conversations, recent_tasks)
+        ]
         
-        return result
+        return Response(
+            content=_conversation_list_adapter.dump_json(result),
+            media_type="application/json"
+        )
         
     except Exception as e:
         logger.error("Failed to get conversations", error=str(e), user_id=str(current_user.id))
@@ -122,13 +139,17 @@ async def get_conversations(
 
 @router.get("/conversations/{conversation_id}", response_model=ConversationResponse)
 async def get_conversation(
-    conversation_id: str,
+    conversation_id: PyObjectId,
+    before: Optional[str] = Query(
+        None,
+        description="Return messages older than this cursor (a next_cursor)"
+    ),
+    limit: int = Query(20, ge=1, le=100),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Get a specific conversation with messages."""
+    """Get a conversation with a page of its messages, newest first."""
     try:
-        conv_id = get_object_id(conversation_id)
-        conversation = await Conversation.get(conv_id)
+        conversation = await Conversation.get(conversation_id)
         
         if not conversation or conversation.user_id != current_user.id:
             raise HTTPException(
@@ -136,10 +157,29 @@ async def get_conversation(
                 detail="Conversation not found"
             )
         
-        # Get all messages
-        messages = await conversation.get_messages(limit=100)
+        try:
+            cursor = None
+            if before is not None:
+                cursor = parse_message_cursor(before)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
         
-        return ConversationResponse(
+        # One extra message tells whether an older page exists
+        messages = await Message.recent(
+            conversation.id,
+            limit=limit + 1,
+            projection=MessageBriefProjection,
+            before=cursor
+        )
+        next_cursor = None
+        if len(messages) > limit:
+            next_cursor = encode_message_cursor(messages[limit - 1])
+        messages = messages[:limit]
+        
+        result = ConversationResponse.model_construct(
             id=str(conversation.id),
             user_id=str(conversation.user_id),
             title=conversation.title,
@@ -147,24 +187,23 @@ async def get_conversation(
             created_at=conversation.created_at,
             updated_at=conversation.updated_at,
             message_count=conversation.message_count,
-            recent_messages=[
-                MessageResponse(
-                    id=str(msg.id),
-                    conversation_id=str(msg.conversation_id),
-                    content=msg.content,
-                    message_type=msg.message_type,
-                    status=msg.status,
-                    timestamp=msg.timestamp,
-                    confidence_score=msg.confidence_score
-                )
-                for msg in messages
-            ]
+            recent_messages=[msg.to_response() for msg in messages],
+            next_cursor=next_cursor
+        )
+        
+        return Response(
+            content=_conversation_adapter.dump_json(result),
+            media_type="application/json"
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error("Failed to get conversation", error=str(e), conversation_id=conversation_id)
+        logger.error(
+            "Failed to get conversation",
+            error=str(e),
+            conversation_id=str(conversation_id)
+        )
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to retrieve conversation"
@@ -181,9 +220,9 @@ async def create_conversation(
         conversation = Conversation(
             user_id=current_user.id,
             title=request.title or "New Conversation",
-            model_config=request.model_config or {}
+            generation_config=request.generation_config or {}
         )
-        await conversation.insert()
+        await conversation.insert_with_stats()
         
         return ConversationResponse(
             id=str(conversation.id),
@@ -206,13 +245,12 @@ async def create_conversation(
 
 @router.delete("/conversations/{conversation_id}")
 async def delete_conversation(
-    conversation_id: str,
+    conversation_id: PyObjectId,
     current_user: User = Depends(get_current_active_user)
 ):
     """Delete a conversation and all its messages."""
     try:
-        conv_id = get_object_id(conversation_id)
-        conversation = await Conversation.get(conv_id)
+        conversation = await Conversation.get(conversation_id)
         
         if not conversation or conversation.user_id != current_user.id:
             raise HTTPException(
@@ -220,18 +258,35 @@ async def delete_conversation(
                 detail="Conversation not found"
             )
         
-        # Delete all messages in the conversation
-        await Message.find(Message.conversation_id == conv_id).delete()
-        
-        # Delete the conversation
-        await conversation.delete()
+        # Beanie's delete query is awaitable but not a coroutine, so wrap it
+        # for the TaskGroup
+        async def delete_messages():
+            await Message.find(
+                Message.conversation_id == conversation_id
+            ).delete()
+
+        # Delete the messages (one delete_many) and the conversation together
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(delete_messages())
+            tg.create_task(conversation.delete())
+            tg.create_task(User.increment_stats(
+                current_user.id,
+                conversations=-1,
+                active=-int(conversation.status == ConversationStatus.ACTIVE),
+                messages=-conversation.message_count
+            ))
+        conversation_manager.forget_conversation(str(conversation_id))
         
         return {"message": "Conversation deleted successfully"}
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error("Failed to delete conversation", error=str(e), conversation_id=conversation_id)
+        logger.error(
+            "Failed to delete conversation",
+            error=str(e),
+            conversation_id=str(conversation_id)
+        )
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to delete conversation"
@@ -1,14 +1,18 @@
 """
 Conversation management API endpoints.
 """
+import re
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Response, status, Query
+from pydantic import BaseModel, Field
 from bson import ObjectId
 
-from app.models.user import User
+from app.clock import coarse_utcnow
+from app.models.user import User, UserStats
 from app.models.conversation import (
-    Conversation, Message, MessageResponse, ConversationStatus
+    Conversation, Message, MessageResponse, ConversationStatus,
+    API_SCHEMA_CONFIG, MessageBriefProjection, encode_message_cursor,
+    parse_message_cursor
 )
 from app.api.dependencies import get_current_active_user, get_object_id
 from app.ai.conversation_manager import conversation_manager
@@ -21,9 +25,13 @@ router = APIRouter()
 
 class ConversationUpdate(BaseModel):
     """Model for updating conversation properties."""
+    model_config = API_SCHEMA_CONFIG
+    
     title: Optional[str] = None
     status: Optional[ConversationStatus] = None
-    model_config: Optional[dict] = None
+    generation_config: Optional[dict] = Field(
+        default=None, alias="model_config"
+    )
 
 
 class ConversationStats(BaseModel):
@@ -34,29 +42,52 @@ class ConversationStats(BaseModel):
     avg_messages_per_conversation: float
 
 
+async def _aggregate_conversation_stats(user_id: ObjectId) -> dict:
+    """Count a user's conversations and sum their messages in one trip."""
+    is_active = {"$eq": ["$status", ConversationStatus.ACTIVE.value]}
+    stats = await Conversation.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {
+            "_id": None,
+            "total_conversations": {"$sum": 1},
+            "active_conversations": {"$sum": {"$cond": [is_active, 1, 0]}},
+            "total_messages": {"$sum": "$message_count"}
+        }},
+        {"$project": {"_id": 0}}
+    ]).to_list(1)
+    return stats[0] if stats else UserStats().model_dump()
+
+
 @router.get("/conversations/stats", response_model=ConversationStats)
 async def get_conversation_stats(
     current_user: User = Depends(get_current_active_user)
 ):
     """Get conversation statistics for the current user."""
     try:
-        # Get total conversations
-        total_conversations = await Conversation.find(
-            Conversation.user_id == current_user.id
-        ).count()
-        
-        # Get active conversations
-        active_conversations = await Conversation.find(
-            Conversation.user_id == current_user.id,
-            Conversation.status == ConversationStatus.ACTIVE
-        ).count()
-        
-        # Get total messages
-        user_conversations = await Conversation.find(
-            Conversation.user_id == current_user.id
-        ).to_list()
-        
-        total_messages = sum(conv.message_count for conv in user_conversations)
+        # Point read of the materialized counters
+        user_doc = await User.get_motor_collection().find_one(
+            {"_id": current_user.id}, {"stats": 1}
+        )
+        totals = user_doc.get("stats") if user_doc else None
+        if totals is None:
+            # Users created before the counters existed: compute once and store
+            totals = await _aggregate_conversation_stats(current_user.id)
+            unset = {"_id": current_user.id, "stats": None}
+            claimed = await User.find_one(unset).update(
+                {"$set": {"stats": totals}}
+            )
+            if claimed.modified_count:
+                # Writes that landed during the first count skipped their $inc
+                # (stats was still unset); now that increments apply, recount
+                # so they are included
+                totals = await _aggregate_conversation_stats(current_user.id)
+                await User.find_one({"_id": current_user.id}).update(
+                    {"$set": {"stats": totals}}
+                )
+        
+        total_conversations = totals.get("total_conversations", 0)
+        active_conversations = totals.get("active_conversations", 0)
+        total_messages = totals.get("total_messages", 0)
         
         # Calculate average
         avg_messages = total_messages / total_conversations if total_conversations > 0 else 0
@@ -79,11 +110,15 @@ async def get_conversation_stats(
 @router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
 async def get_conversation_messages(
     conversation_id: str,
+    response: Response,
     limit: int = Query(50, ge=1, le=200),
-    offset: int = Query(0, ge=0),
+    before: Optional[str] = Query(
+        None,
+        description="Return messages older than this cursor (X-Next-Cursor)"
+    ),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Get messages from a specific conversation."""
+    """Get messages from a specific conversation, newest first."""
     try:
         conv_id = get_object_id(conversation_id)
         conversation = await Conversation.get(conv_id)
@@ -94,23 +129,30 @@ async def get_conversation_messages(
                 detail="Conversation not found"
             )
         
-        # Get messages with pagination
-        messages = await Message.find(
-            Message.conversation_id == conv_id
-        ).sort(-Message.timestamp).skip(offset).limit(limit).to_list()
-        
-        return [
-            MessageResponse(
-                id=str(msg.id),
-                conversation_id=str(msg.conversation_id),
-                content=msg.content,
-                message_type=msg.message_type,
-                status=msg.status,
-                timestamp=msg.timestamp,
-                confidence_score=msg.confidence_score
+        # Keyset pagination: seek past the cursor on the
+        # (conversation_id, timestamp, _id) index
+        try:
+            cursor = None
+            if before is not None:
+                cursor = parse_message_cursor(before)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
             )
-            for msg in messages
-        ]
+        messages = await Message.recent(
+            conv_id,
+            limit=limit,
+            projection=MessageBriefProjection,
+            before=cursor
+        )
+        
+        # A full page may have more behind it
+        if len(messages) == limit:
+            next_cursor = encode_message_cursor(messages[-1])
+            response.headers["X-Next-Cursor"] = next_cursor
+        
+        return [msg.to_response() for msg in messages]
         
     except HTTPException:
         raise
@@ -139,24 +181,41 @@ async def update_conversation(
                 detail="Conversation not found"
             )
         
-        # Update fields
+        # Collect a targeted $set rather than re-saving the whole document
         updated_fields = []
+        updates = {}
         
         if update_data.title is not None:
-            conversation.title = update_data.title
+            title = update_data.title
+            updates["title"] = title
+            updates["title_lower"] = Conversation.lower_title(title)
             updated_fields.append("title")
         
+        active_delta = 0
         if update_data.status is not None:
-            conversation.status = update_data.status
+            updates["status"] = update_data.status.value
             updated_fields.append("status")
+            active_delta = (
+                int(update_data.status == ConversationStatus.ACTIVE)
+                - int(conversation.status == ConversationStatus.ACTIVE)
+            )
         
-        if update_data.model_config is not None:
-            conversation.model_config.update(update_data.model_config)
+        if update_data.generation_config is not None:
+            # Merge key by key; the stored settings are not replaced wholesale
+            for key, value in update_data.generation_config.items():
+                updates[f"model_config.{key}"] = value
             updated_fields.append("model_config")
         
         if updated_fields:
             conversation.update_timestamp()
-            await conversation.save()
+            updates["updated_at"] = conversation.updated_at
+            await conversation.set(updates)
+            if "title" in updated_fields:
+                await conversation.sync_message_titles()
+            if active_delta:
+                await User.increment_stats(
+                    current_user.id, active=active_delta
+                )
             
             logger.info(
                 "Conversation updated",
@@ -184,63 +243,76 @@ async def update_conversation(
 async def search_conversations(
     query: str = Query(..., min_length=1),
     limit: int = Query(20, ge=1, le=100),
+    exact: bool = Query(
+        False,
+        description=(
+            "Match title prefixes and literal message text instead of "
+            "ranked words"
+        )
+    ),
     current_user: User = Depends(get_current_active_user)
 ):
     """Search conversations by title or content."""
     try:
+        if exact:
+            # An anchored, case-sensitive prefix on the lowercased title
+            # range-scans (user_id, title_lower); the i flag would defeat the
+            # index bounds
+            prefix = f"^{re.escape(query.lower())}"
+            title_filter = {"title_lower": {"$regex": prefix}}
+            literal = re.escape(query)
+            content_filter = {"content": {"$regex": literal, "$options": "i"}}
+        else:
+            # Word search on the text indexes, ranked by relevance
+            title_filter = content_filter = {"$text": {"$search": query}}
+        
         # Search in conversation titles
-        title_matches = await Conversation.find(
-            Conversation.user_id == current_user.id,
-            {"title": {"$regex": query, "$options": "i"}}
-        ).limit(limit).to_list()
+        title_pipeline = [
+            {"$match": {"user_id": current_user.id, **title_filter}}
+        ]
+        if not exact:
+            title_pipeline.append({"$sort": {"score": {"$meta": "textScore"}}})
+        title_pipeline += [
+            {"$limit": limit},
+            {"$project": {"title": 1, "updated_at": 1, "message_count": 1}}
+        ]
+        title_matches = await Conversation.aggregate(title_pipeline).to_list()
+        
+        # Search in message content: filter to this user's messages first,
+        # then count per conversation; titles are denormalized onto messages,
+        # so no join is needed
+        group = {
+            "_id": "$conversation_id",
+            "conversation_title": {"$last": "$conversation_title"},
+            "matching_messages": {"$sum": 1}
+        }
+        if not exact:
+            group["score"] = {"$max": {"$meta": "textScore"}}
         
-        # Search in message content
-        message_matches = await Message.aggregate([
-            {
-                "$match": {
-                    "content": {"$regex": query, "$options": "i"}
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "conversations",
-                    "localField": "conversation_id",
-                    "foreignField": "_id",
-                    "as": "conversation"
-                }
-            },
-            {
-                "$match": {
-                    "conversation.user_id": current_user.id
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$conversation_id",
-                    "conversation": {"$first": "$conversation"},
-                    "matching_messages": {"$push": "$$ROOT"}
-                }
-            },
-            {
-                "$limit": limit
-            }
-        ]).to_list()
+        message_pipeline = [
+            {"$match": {"user_id": current_user.id, **content_filter}},
+            {"$group": group}
+        ]
+        if not exact:
+            message_pipeline.append({"$sort": {"score": -1}})
+        message_pipeline.append({"$limit": limit})
+        message_matches = await Message.aggregate(message_pipeline).to_list()
         
         results = {
             "title_matches": [
                 {
-                    "id": str(conv.id),
-                    "title": conv.title,
-                    "updated_at": conv.updated_at,
-                    "message_count": conv.message_count
+                    "id": str(conv["_id"]),
+                    "title": conv.get("title"),
+                    "updated_at": conv["updated_at"],
+                    "message_count": conv.get("message_count", 0)
                 }
                 for conv in title_matches
             ],
             "content_matches": [
                 {
                     "conversation_id": str(match["_id"]),
-                    "conversation_title": match["conversation"][0]["title"],
-                    "matching_messages": len(match["matching_messages"])
+                    "conversation_title": match["conversation_title"],
+                    "matching_messages": match["matching_messages"]
                 }
                 for match in message_matches
             ]
@@ -256,69 +328,80 @@ async def search_conversations(
         )
 
 
-@router.post("/conversations/{conversation_id}/archive")
-async def archive_conversation(
+async def _set_conversation_status(
     conversation_id: str,
-    current_user: User = Depends(get_current_active_user)
-):
-    """Archive a conversation."""
+    current_user: User,
+    new_status: ConversationStatus,
+    action: str
+) -> dict:
+    """Set a conversation's status in one conditional, owner-scoped update."""
     try:
         conv_id = get_object_id(conversation_id)
-        conversation = await Conversation.get(conv_id)
+        # Returns the document as it was before the update, to adjust the
+        # active count
+        collection = Conversation.get_motor_collection()
+        previous = await collection.find_one_and_update(
+            {"_id": conv_id, "user_id": current_user.id},
+            {"$set": {
+                "status": new_status.value,
+                "updated_at": coarse_utcnow()
+            }},
+            projection={"status": 1}
+        )
         
-        if not conversation or conversation.user_id != current_user.id:
+        if previous is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Conversation not found"
             )
         
-        conversation.status = ConversationStatus.ARCHIVED
-        conversation.update_timestamp()
-        await conversation.save()
+        active = ConversationStatus.ACTIVE
+        active_delta = (
+            int(new_status == active)
+            - int(previous.get("status") == active.value)
+        )
+        if active_delta:
+            await User.increment_stats(current_user.id, active=active_delta)
         
-        logger.info("Conversation archived", conversation_id=conversation_id, user_id=str(current_user.id))
+        logger.info(
+            f"Conversation {action}d",
+            conversation_id=conversation_id,
+            user_id=str(current_user.id)
+        )
         
-        return {"message": "Conversation archived successfully"}
+        return {"message": f"Conversation {action}d successfully"}
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error("Failed to archive conversation", error=str(e), conversation_id=conversation_id)
+        logger.error(
+            f"Failed to {action} conversation",
+            error=str(e),
+            conversation_id=conversation_id
+        )
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to archive conversation"
+            detail=f"Failed to {action} conversation"
         )
 
 
+@router.post("/conversations/{conversation_id}/archive")
+async def archive_conversation(
+    conversation_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Archive a conversation."""
+    return await _set_conversation_status(
+        conversation_id, current_user, ConversationStatus.ARCHIVED, "archive"
+    )
+
+
 @router.post("/conversations/{conversation_id}/restore")
 async def restore_conversation(
     conversation_id: str,
     current_user: User = Depends(get_current_active_user)
 ):
     """Restore an archived conversation."""
-    try:
-        conv_id = get_object_id(conversation_id)
-        conversation = await Conversation.get(conv_id)
-        
-        if not conversation or conversation.user_id != current_user.id:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Conversation not found"
-            )
-        
-        conversation.status = ConversationStatus.ACTIVE
-        conversation.update_timestamp()
-        await conversation.save()
-        
-        logger.info("Conversation restored", conversation_id=conversation_id, user_id=str(current_user.id))
-        
-        return {"message": "Conversation restored successfully"}
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error("Failed to restore conversation", error=str(e), conversation_id=conversation_id)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to restore conversation"
-        )
+    return await _set_conversation_status(
+        conversation_id, current_user, ConversationStatus.ACTIVE, "restore"
+    )
@@ -9,8 +9,10 @@ from jose import jwt
 from pydantic import BaseModel, EmailStr
 
 from app.config import settings
-from app.models.user import User, UserCreate, UserResponse
-from app.api.dependencies import get_current_active_user
+from app.models.user import User, UserCreate, UserResponse, UserStats
+from app.api.dependencies import (
+    get_current_active_user, invalidate_cached_user
+)
 import structlog
 
 logger = structlog.get_logger()
@@ -72,7 +74,8 @@ async def register_user(user_data: UserRegistration):
             email=user_data.email,
             username=user_data.username,
             full_name=user_data.full_name,
-            hashed_password=hashed_password
+            hashed_password=hashed_password,
+            stats=UserStats()
         )
         
         await user.insert()
@@ -125,7 +128,8 @@ async def login_user(form_data: OAuth2PasswordRequestForm = Depends()):
         # Create access token
         access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
         access_token = create_access_token(
-            data={"sub": str(user.id)}, expires_delta=access_token_expires
+            data={"sub": str(user.id), "ver": user.token_version},
+            expires_delta=access_token_expires
         )
         
         logger.info("User logged in successfully", user_id=str(user.id), username=user.username)
@@ -167,12 +171,16 @@ async def update_current_user(
         # Update allowed fields
         allowed_fields = ["full_name", "preferred_language", "conversation_settings"]
         
-        for field, value in user_update.items():
-            if field in allowed_fields:
-                setattr(current_user, field, value)
+        updates = {
+            field: value for field, value in user_update.items()
+            if field in allowed_fields
+        }
         
+        # Targeted $set, leaving concurrently maintained fields (stats) alone
         current_user.update_timestamp()
-        await current_user.save()
+        updates["updated_at"] = current_user.updated_at
+        await current_user.set(updates)
+        await invalidate_cached_user(current_user.id)
         
         logger.info("User updated successfully", user_id=str(current_user.id))
         
@@ -218,10 +226,14 @@ async def change_password(
                 detail="Incorrect current password"
             )
         
-        # Update password
-        current_user.hashed_password = User.hash_password(new_password)
+        # Update password and revoke tokens issued with the old one
         current_user.update_timestamp()
-        await current_user.save()
+        await current_user.set({
+            "hashed_password": User.hash_password(new_password),
+            "token_version": current_user.token_version + 1,
+            "updated_at": current_user.updated_at
+        })
+        await invalidate_cached_user(current_user.id)
         
         logger.info("Password changed successfully", user_id=str(current_user.id))
         
@@ -0,0 +1,28 @@
+"""
+Coarse wall clock for timestamps that do not need sub-second precision.
+"""
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+# How often the cached time is refreshed, in seconds
+TICK_INTERVAL = 0.25
+
+# Latest cached time; None while no ticker is running
+_now: Optional[datetime] = None
+
+
+def coarse_utcnow() -> datetime:
+    """Current UTC time, up to TICK_INTERVAL stale while the ticker runs."""
+    return _now or datetime.utcnow()
+
+
+async def tick():
+    """Refresh the cached time until cancelled."""
+    global _now
+    try:
+        while True:
+            _now = datetime.utcnow()
+            await asyncio.sleep(TICK_INTERVAL)
+    finally:
+        _now = None
@@ -27,6 +27,13 @@ class Settings(BaseSettings):
     max_tokens: int = 512
     temperature: float = 0.7
     model_cache_dir: str = "./models"
+    embedding_backend: str = "torch"  # "torch" or "onnx"
+    embedding_fp16: bool = True  # Only applied on CUDA devices
+    # "float32", "float16", "int8" or "binary"
+    embedding_precision: str = "float32"
+    compile_model: bool = True  # torch.compile the conversation model on CUDA
+    quantization: Optional[str] = None  # None, "int8" or "int4"
+    load_models: bool = True  # Load AI models at startup
     
     # Authentication settings
     secret_key: str = "your-secret-key-change-in-production"
@@ -36,6 +43,9 @@ class Settings(BaseSettings):
     # CORS settings
     cors_origins: list = ["http://localhost:3000", "http://localhost:3001"]
     
+    # WebSocket settings
+    batch_ws: bool = False  # Coalesce multi-event chat replies into one frame
+    
     # Redis settings (for background tasks)
     redis_url: str = "redis://localhost:6379"
     
@@ -1,8 +1,10 @@
 """
 Database connection and initialization.
 """
+from datetime import datetime
 import motor.motor_asyncio
 from beanie import init_beanie
+from pymongo import UpdateMany, UpdateOne
 import structlog
 
 from app.config import settings
@@ -11,6 +13,9 @@ from app.models.conversation import Conversation, Message
 
 logger = structlog.get_logger()
 
+# Write operations sent per bulk_write during backfills
+BACKFILL_BATCH_SIZE = 500
+
 
 class Database:
     """Database connection manager."""
@@ -55,6 +60,77 @@ async def init_database():
     )
     
     logger.info("Beanie ODM initialized successfully")
+    
+    await run_migration_once(
+        "conversation_title_lower", backfill_title_lower
+    )
+    await run_migration_once(
+        "message_search_fields", backfill_message_search_fields
+    )
+
+
+async def run_migration_once(name: str, migrate):
+    """Run a data migration unless the migrations collection lists it."""
+    migrations = db.database["migrations"]
+    if await migrations.find_one({"_id": name}):
+        return
+    
+    await migrate()
+    
+    # Upsert, as several workers may finish the same (idempotent) migration
+    await migrations.update_one(
+        {"_id": name},
+        {"$set": {"completed_at": datetime.utcnow()}},
+        upsert=True
+    )
+    logger.info("Applied data migration", migration=name)
+
+
+async def _bulk_write(collection, operations: list):
+    """Send and clear a batch of backfill writes."""
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+        operations.clear()
+
+
+async def backfill_title_lower():
+    """Set title_lower on conversations stored before search used it."""
+    conversations = Conversation.get_motor_collection()
+    
+    updates = []
+    missing = {"title_lower": {"$exists": False}}
+    async for conv in conversations.find(missing, {"title": 1}):
+        title_lower = Conversation.lower_title(conv.get("title"))
+        updates.append(UpdateOne(
+            {"_id": conv["_id"]},
+            {"$set": {"title_lower": title_lower}}
+        ))
+        if len(updates) >= BACKFILL_BATCH_SIZE:
+            await _bulk_write(conversations, updates)
+    
+    await _bulk_write(conversations, updates)
+
+
+async def backfill_message_search_fields():
+    """Copy each conversation's owner and title onto its older messages."""
+    conversations = Conversation.get_motor_collection()
+    messages = Message.get_motor_collection()
+    
+    updates = []
+    async for conv in conversations.find({}, {"user_id": 1, "title": 1}):
+        # Only messages still missing their owner, found by the
+        # conversation_id index
+        updates.append(UpdateMany(
+            {"conversation_id": conv["_id"], "user_id": None},
+            {"$set": {
+                "user_id": conv["user_id"],
+                "conversation_title": conv.get("title")
+            }}
+        ))
+        if len(updates) >= BACKFILL_BATCH_SIZE:
+            await _bulk_write(messages, updates)
+    
+    await _bulk_write(messages, updates)
 
 
 async def get_database():
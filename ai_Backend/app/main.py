@@ -4,10 +4,16 @@ Main FastAPI application entry point.
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import ORJSONResponse
+import asyncio
+import contextlib
 import structlog
 
+from app import clock
 from app.config import settings
 from app.database import init_database
+from app.realtime import realtime
+from app.api.dependencies import subscribe_user_invalidations
 from app.api.routes import chat, users, conversations
 from app.websocket import websocket_router
 
@@ -38,6 +44,8 @@ app = FastAPI(
     version=settings.app_version,
     description="AI-powered conversational backend with NLU capabilities",
     debug=settings.debug,
+    # Serialize response bodies with orjson
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -60,12 +68,29 @@ app.add_middleware(
 async def startup_event():
     """Initialize application on startup."""
     logger.info("Starting AI Backend application", version=settings.app_version)
+    
+    # Keep a cached clock for updated_at timestamps
+    app.state.clock_task = asyncio.create_task(clock.tick())
 
     # Initialize database connection
     await init_database()
     logger.info("Database initialized successfully")
 
+    # Connect the realtime pub/sub broker
+    app.state.invalidation_task = None
+    try:
+        await realtime.connect()
+        app.state.invalidation_task = await subscribe_user_invalidations()
+    except Exception as e:
+        logger.warning("Failed to connect realtime broker", error=str(e))
+        logger.info(
+            "Application will continue without cross-worker event fan-out."
+        )
+
     # Initialize AI models
+    if not settings.load_models:
+        logger.info("AI model loading disabled; AI features will not work.")
+        return
     try:
         from app.ai.models import model_manager
         await model_manager.initialize_models()
@@ -79,6 +104,14 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on application shutdown."""
     logger.info("Shutting down AI Backend application")
+    if app.state.invalidation_task is not None:
+        app.state.invalidation_task.cancel()
+        await app.state.invalidation_task
+    await realtime.disconnect()
+    
+    app.state.clock_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await app.state.clock_task
 
 
 @app.get("/")
@@ -97,10 +130,11 @@ async def health_check():
     return {"status": "healthy", "service": settings.app_name}
 
 
-# Include API routers
+# Include API routers (conversations first, so /conversations/search and /stats
+# are matched before the chat router's /conversations/{conversation_id})
+app.include_router(conversations.router, prefix="/api/v1", tags=["conversations"])
 app.include_router(chat.router, prefix="/api/v1", tags=["chat"])
 app.include_router(users.router, prefix="/api/v1", tags=["users"])
-app.include_router(conversations.router, prefix="/api/v1", tags=["conversations"])
 
 # Include WebSocket router
 app.include_router(websocket_router, prefix="/ws")
@@ -1,12 +1,42 @@
 """
 Conversation and Message models for chat functionality.
 """
+import asyncio
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Type
 from enum import Enum
-from beanie import Document, Indexed
-from pydantic import Field
+from beanie import (
+    Document, Indexed, Insert, PydanticObjectId, Replace, Save, before_event
+)
+from beanie.operators import And, Or
+from pydantic import BaseModel, ConfigDict, Field
 from bson import ObjectId
+from pymongo import IndexModel, TEXT
+
+from app.clock import coarse_utcnow
+from app.models.user import User
+
+
+# ObjectId parsed once during request validation (malformed IDs are rejected
+# with a 422) and serialized as its hex string; usable for body fields and
+# path/query params
+PyObjectId = PydanticObjectId
+
+# Position in a conversation's newest-first message order: (timestamp, _id)
+MessageCursor = Tuple[datetime, ObjectId]
+
+
+def encode_message_cursor(message: Any) -> str:
+    """Opaque cursor pointing just past ``message`` in newest-first order."""
+    return f"{message.timestamp.isoformat()}_{message.id}"
+
+
+def parse_message_cursor(cursor: str) -> MessageCursor:
+    """Parse an encode_message_cursor cursor; ValueError if malformed."""
+    timestamp, _, message_id = cursor.rpartition("_")
+    if not ObjectId.is_valid(message_id):
+        raise ValueError("Invalid cursor")
+    return datetime.fromisoformat(timestamp), ObjectId(message_id)
 
 
 class MessageType(str, Enum):
@@ -24,10 +54,30 @@ class MessageStatus(str, Enum):
     FAILED = "failed"
 
 
-class Message(Document):
+class MessageResponseMixin:
+    """Builds the API representation of anything shaped like a message."""
+    
+    def to_response(self) -> "MessageResponse":
+        """Build the API representation without re-validating stored fields."""
+        return MessageResponse.model_construct(
+            id=str(self.id),
+            conversation_id=str(self.conversation_id),
+            content=self.content,
+            message_type=self.message_type,
+            status=self.status,
+            timestamp=self.timestamp,
+            confidence_score=self.confidence_score
+        )
+
+
+class Message(MessageResponseMixin, Document):
     """Message document model."""
     
-    conversation_id: Indexed(ObjectId)
+    conversation_id: Indexed(PydanticObjectId)
+    # Owner and title of the conversation, denormalized for search; the title
+    # is kept in sync on rename
+    user_id: Optional[PydanticObjectId] = None
+    conversation_title: Optional[str] = None
     content: str
     message_type: MessageType
     status: MessageStatus = MessageStatus.COMPLETED
@@ -37,6 +87,8 @@ class Message(Document):
     model_used: Optional[str] = None
     confidence_score: Optional[float] = None
     processing_time: Optional[float] = None
+    # Prompt tokens, cached for context pruning
+    token_count: Optional[int] = None
     
     # Metadata
     metadata: Dict[str, Any] = Field(default_factory=dict)
@@ -44,10 +96,55 @@ class Message(Document):
     class Settings:
         name = "messages"
         indexes = [
-            "conversation_id",
-            "timestamp",
-            "message_type",
+            [("conversation_id", 1), ("timestamp", -1), ("_id", -1)],
+            [("conversation_id", 1), ("status", 1), ("timestamp", -1)],
+            IndexModel(
+                [("user_id", 1), ("content", TEXT)], name="user_content_text"
+            ),
         ]
+    
+    @classmethod
+    def older_than(cls, cursor: MessageCursor):
+        """Filter for messages after ``cursor`` in newest-first order."""
+        timestamp, message_id = cursor
+        # Messages written in the same clock tick share a timestamp; _id
+        # breaks the tie
+        return Or(
+            cls.timestamp < timestamp,
+            And(cls.timestamp == timestamp, cls.id < message_id)
+        )
+    
+    @classmethod
+    async def recent(
+        cls, 
+        conversation_id: ObjectId, 
+        limit: int = 50,
+        projection: Optional[Type[BaseModel]] = None,
+        before: Optional[MessageCursor] = None
+    ) -> List[Any]:
+        """
+        Get the newest messages of a conversation, optionally projected.
+        
+        With ``before``, only messages older than that cursor are returned.
+        """
+        query = cls.find(cls.conversation_id == conversation_id)
+        if before is not None:
+            query = query.find(cls.older_than(before))
+        query = query.sort(-cls.timestamp, -cls.id).limit(limit)
+        if projection is not None:
+            query = query.project(projection)
+        return await query.to_list()
+
+
+class MessageBriefProjection(MessageResponseMixin, BaseModel):
+    """Only the message fields needed for API responses."""
+    id: PydanticObjectId = Field(alias="_id")
+    conversation_id: PydanticObjectId
+    content: str
+    message_type: MessageType
+    status: MessageStatus
+    timestamp: datetime
+    confidence_score: Optional[float] = None
 
 
 class ConversationStatus(str, Enum):
@@ -61,14 +158,19 @@ class ConversationStatus(str, Enum):
 class Conversation(Document):
     """Conversation document model."""
     
-    user_id: Indexed(ObjectId)
+    user_id: Indexed(PydanticObjectId)
     title: Optional[str] = None
+    # Lowercased title, for index-backed prefix search
+    title_lower: Optional[str] = None
     status: ConversationStatus = ConversationStatus.ACTIVE
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=coarse_utcnow)
     
-    # Conversation settings
-    model_config: Dict[str, Any] = Field(default_factory=dict)
+    # Conversation settings ("model_config" is reserved by pydantic, so it is
+    # only the alias)
+    generation_config: Dict[str, Any] = Field(
+        default_factory=dict, alias="model_config"
+    )
     context_window: int = 10  # Number of previous messages to consider
     
     # Analytics
@@ -81,49 +183,130 @@ class Conversation(Document):
     class Settings:
         name = "conversations"
         indexes = [
-            "user_id",
-            "created_at",
-            "updated_at",
-            "status",
+            [("user_id", 1), ("status", 1)],
+            [("user_id", 1), ("updated_at", -1)],
+            [("user_id", 1), ("title_lower", 1)],
+            IndexModel(
+                [("title", TEXT)], weights={"title": 10}, name="title_text"
+            ),
         ]
     
+    @staticmethod
+    def lower_title(title: Optional[str]) -> Optional[str]:
+        """The title_lower value stored for a title."""
+        return title.lower() if title else title
+    
+    @before_event(Insert, Replace, Save)
+    def sync_title_lower(self):
+        """Keep title_lower in step with title on whole-document writes."""
+        self.title_lower = self.lower_title(self.title)
+    
     def update_timestamp(self):
         """Update the updated_at timestamp."""
-        self.updated_at = datetime.utcnow()
+        self.updated_at = coarse_utcnow()
+    
+    async def insert_with_stats(self) -> "Conversation":
+        """Insert a new conversation and count it in its owner's stats."""
+        await asyncio.gather(
+            self.insert(),
+            User.increment_stats(
+                self.user_id,
+                conversations=1,
+                active=int(self.status == ConversationStatus.ACTIVE)
+            )
+        )
+        return self
     
     async def get_messages(self, limit: int = 50) -> List[Message]:
         """Get messages for this conversation."""
-        return await Message.find(
-            Message.conversation_id == self.id
-        ).sort(-Message.timestamp).limit(limit).to_list()
+        return await Message.recent(self.id, limit=limit)
+    
+    async def get_context_messages(self, limit: int) -> List[Dict[str, Any]]:
+        """Get the newest completed messages, oldest first, as dicts."""
+        is_user = {"$eq": ["$message_type", MessageType.USER.value]}
+        return await Message.aggregate([
+            {"$match": {
+                "conversation_id": self.id,
+                "status": MessageStatus.COMPLETED.value
+            }},
+            {"$sort": {"timestamp": -1}},
+            {"$limit": limit},
+            {"$sort": {"timestamp": 1}},
+            {"$project": {
+                "_id": 0,
+                "role": {"$cond": [is_user, "user", "assistant"]},
+                "content": 1,
+                "token_count": 1
+            }}
+        ]).to_list()
+    
+    async def sync_message_titles(self):
+        """Copy the current title onto this conversation's messages."""
+        await Message.find(Message.conversation_id == self.id).update(
+            {"$set": {"conversation_title": self.title}}
+        )
     
     async def add_message(self, content: str, message_type: MessageType, **kwargs) -> Message:
         """Add a new message to the conversation."""
         message = Message(
             conversation_id=self.id,
+            user_id=self.user_id,
+            conversation_title=self.title,
             content=content,
             message_type=message_type,
             **kwargs
         )
-        await message.insert()
         
-        # Update conversation stats
+        # Insert the message and update conversation stats atomically, in
+        # parallel; bulk writes cannot span the two collections
         self.message_count += 1
         self.update_timestamp()
-        await self.save()
+        await asyncio.gather(
+            message.insert(),
+            Conversation.find_one(Conversation.id == self.id).update({
+                "$inc": {"message_count": 1},
+                "$set": {"updated_at": self.updated_at}
+            }),
+            User.increment_stats(self.user_id, messages=1)
+        )
         
         return message
 
 
+class ConversationListProjection(BaseModel):
+    """Only the conversation fields needed for list responses."""
+    id: PydanticObjectId = Field(alias="_id")
+    user_id: PydanticObjectId
+    title: Optional[str] = None
+    status: ConversationStatus
+    created_at: datetime
+    updated_at: datetime
+    message_count: int = 0
+
+
 # Pydantic schemas for API
-class MessageCreate(Document):
+# Schemas are built once per request and never mutated, so skip assignment
+# hooks
+API_SCHEMA_CONFIG = ConfigDict(
+    extra="ignore",
+    frozen=True,
+    populate_by_name=True,
+    validate_assignment=False
+)
+
+
+class MessageCreate(BaseModel):
     """Schema for creating a message."""
+    model_config = API_SCHEMA_CONFIG
+    
     content: str
     message_type: MessageType = MessageType.USER
 
 
-class MessageResponse(Document):
+class MessageResponse(BaseModel):
     """Schema for message response."""
+    model_config = API_SCHEMA_CONFIG
+    
     id: str
     conversation_id: str
     content: str
@@ -133,14 +316,20 @@ class MessageResponse(Document):
     confidence_score: Optional[float] = None
 
 
-class ConversationCreate(Document):
+class ConversationCreate(BaseModel):
     """Schema for creating a conversation."""
+    model_config = API_SCHEMA_CONFIG
+    
     title: Optional[str] = None
-    model_config: Dict[str, Any] = Field(default_factory=dict)
+    generation_config: Dict[str, Any] = Field(
+        default_factory=dict, alias="model_config"
+    )
 
 
-class ConversationResponse(Document):
+class ConversationResponse(BaseModel):
     """Schema for conversation response."""
+    model_config = API_SCHEMA_CONFIG
+    
     id: str
     user_id: str
     title: Optional[str] = None
@@ -149,3 +338,5 @@ class ConversationResponse(Document):
     updated_at: datetime
     message_count: int
     recent_messages: List[MessageResponse] = Field(default_factory=list)
+    # Pass as ?before= to fetch the next, older page
+    next_cursor: Optional[str] = None
@@ -1,14 +1,40 @@
 """
 User model for authentication and user management.
 """
+import hashlib
+import hmac
+import secrets
+import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from beanie import Document, Indexed
-from pydantic import EmailStr, Field
+from bson import ObjectId
+from pydantic import BaseModel, EmailStr, Field
 from passlib.context import CryptContext
 
+from app.clock import coarse_utcnow
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Successful password checks remembered briefly so bursts of logins skip bcrypt
+VERIFY_CACHE_SIZE = 10_000
+VERIFY_CACHE_TTL = 60  # seconds
+
+# (user id, stored hash, keyed password digest) -> monotonic expiry; a password
+# change alters the stored hash, so old entries can never match again
+_verify_cache: "OrderedDict[Tuple, float]" = OrderedDict()
+
+# Per-process key, so cached digests are useless outside this process
+_VERIFY_KEY = secrets.token_bytes(32)
+
+
+class UserStats(BaseModel):
+    """Conversation counters, updated alongside the changes they count."""
+    total_conversations: int = 0
+    active_conversations: int = 0
+    total_messages: int = 0
+
 
 class User(Document):
     """User document model."""
@@ -19,13 +45,18 @@ class User(Document):
     hashed_password: str
     is_active: bool = True
     is_verified: bool = False
+    token_version: int = 0  # Bumped to revoke all previously issued tokens
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=coarse_utcnow)
     
     # User preferences
     preferred_language: str = "en"
     conversation_settings: dict = Field(default_factory=dict)
     
+    # Materialized conversation stats; None until first initialized for users
+    # created before they existed
+    stats: Optional[UserStats] = None
+    
     class Settings:
         name = "users"
         indexes = [
@@ -41,14 +72,51 @@ class User(Document):
     
     def verify_password(self, password: str) -> bool:
         """Verify a password against the hash."""
-        return pwd_context.verify(password, self.hashed_password)
+        digest = hmac.new(
+            _VERIFY_KEY, password.encode(), hashlib.sha256
+        ).digest()
+        key = (self.id, self.hashed_password, digest)
+        now = time.monotonic()
+        
+        expires_at = _verify_cache.get(key)
+        if expires_at is not None and now < expires_at:
+            _verify_cache.move_to_end(key)
+            return True
+        
+        if not pwd_context.verify(password, self.hashed_password):
+            return False
+        
+        _verify_cache[key] = now + VERIFY_CACHE_TTL
+        _verify_cache.move_to_end(key)
+        if len(_verify_cache) > VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+        return True
     
     def update_timestamp(self):
         """Update the updated_at timestamp."""
-        self.updated_at = datetime.utcnow()
+        self.updated_at = coarse_utcnow()
+    
+    @classmethod
+    async def increment_stats(
+        cls,
+        user_id: ObjectId,
+        conversations: int = 0,
+        active: int = 0,
+        messages: int = 0
+    ):
+        """Apply deltas to a user's stats counters, once initialized."""
+        deltas = {
+            "stats.total_conversations": conversations,
+            "stats.active_conversations": active,
+            "stats.total_messages": messages
+        }
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if deltas:
+            initialized = {"_id": user_id, "stats": {"$ne": None}}
+            await cls.find_one(initialized).update({"$inc": deltas})
 
 
-class UserCreate(Document):
+class UserCreate(BaseModel):
     """Schema for user creation."""
     email: EmailStr
     username: str
@@ -56,7 +124,7 @@ class UserCreate(Document):
     password: str
 
 
-class UserResponse(Document):
+class UserResponse(BaseModel):
     """Schema for user response (without sensitive data)."""
     id: str
     email: EmailStr
@@ -0,0 +1,97 @@
+"""
+Redis pub/sub fan-out for real-time events.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+import orjson
+import redis.asyncio as redis
+import structlog
+
+from app.config import settings
+
+logger = structlog.get_logger()
+
+# Channel announcing users whose account changed (e.g. their tokens were
+# revoked), so every worker drops them from its user cache
+USER_INVALIDATION_CHANNEL = "auth:invalidate"
+
+
+def notification_channel(user_id: str) -> str:
+    """Channel carrying general notifications for a user."""
+    return f"notif:{user_id}"
+
+
+def chat_channel(user_id: str) -> str:
+    """Channel carrying chat activity for a user."""
+    return f"chat:{user_id}"
+
+
+class RealtimeBroker:
+    """Publishes events to Redis and relays subscribed channels to clients."""
+    
+    def __init__(self):
+        self.redis: Optional[redis.Redis] = None
+    
+    async def connect(self):
+        """Connect to Redis."""
+        try:
+            self.redis = redis.from_url(settings.redis_url)
+            await self.redis.ping()
+            logger.info("Connected to Redis successfully")
+        except Exception as e:
+            logger.error("Failed to connect to Redis", error=str(e))
+            self.redis = None
+            raise
+    
+    async def disconnect(self):
+        """Disconnect from Redis."""
+        if self.redis:
+            await self.redis.close()
+            self.redis = None
+            logger.info("Disconnected from Redis")
+    
+    async def publish(self, channel: str, payload: dict) -> bool:
+        """Publish an event; returns False when Redis is unavailable."""
+        if self.redis is None:
+            return False
+        
+        try:
+            await self.redis.publish(channel, orjson.dumps(payload))
+            return True
+        except Exception as e:
+            logger.warning(
+                "Failed to publish event", error=str(e), channel=channel
+            )
+            return False
+    
+    async def subscribe(
+        self,
+        deliver: Callable[[Any], Awaitable[None]],
+        *channels: str
+    ) -> Optional[asyncio.Task]:
+        """Relay decoded payloads from the given channels to `deliver`."""
+        if self.redis is None or not channels:
+            return None
+        
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(*channels)
+        return asyncio.create_task(self._pump(deliver, pubsub))
+    
+    async def _pump(self, deliver: Callable[[Any], Awaitable[None]], pubsub):
+        """Forward published payloads until cancelled or delivery fails."""
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                await deliver(orjson.loads(message["data"]))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning("Realtime relay stopped", error=str(e))
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.close()
+
+
+# Global realtime broker instance
+realtime = RealtimeBroker()
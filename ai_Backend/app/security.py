@@ -2,50 +2,121 @@
 Security utilities and middleware.
 """
 import time
-from typing import Dict, Optional
+import uuid
+from typing import Dict, Optional, Tuple
 from fastapi import Request, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import structlog
 
+from app.realtime import realtime
+
 logger = structlog.get_logger()
 
+# Sliding window over a sorted set of request timestamps, applied atomically
+# in one round trip.
+# KEYS[1] = limiter key; ARGV = now, window, max requests, unique member
+SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+if redis.call('ZCARD', key) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('EXPIRE', key, math.ceil(window))
+return 1
+"""
+
 
 class RateLimiter:
-    """Simple in-memory rate limiter."""
+    """Sliding-window rate limiter shared across workers through Redis.
     
-    def __init__(self, max_requests: int = 100, window_seconds: int = 3600):
+    Falls back to a per-process window while Redis is unavailable.
+    """
+    
+    def __init__(
+        self,
+        max_requests: int = 100,
+        window_seconds: int = 3600,
+        name: str = "default"
+    ):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.requests: Dict[str, list] = {}
+        self.name = name
+        # identifier -> (count, window start)
+        self.requests: Dict[str, Tuple[int, float]] = {}
+        self._next_sweep = 0.0
+        self._script = None
     
-    def is_allowed(self, identifier: str) -> bool:
+    async def is_allowed(self, identifier: str) -> bool:
         """Check if request is allowed for the given identifier."""
-        current_time = time.time()
+        if realtime.redis is not None:
+            try:
+                return await self._is_allowed_redis(identifier)
+            except Exception as e:
+                logger.warning(
+                    "Redis rate limiting failed, using local window",
+                    error=str(e)
+                )
+        
+        return self._is_allowed_local(identifier)
+    
+    async def _is_allowed_redis(self, identifier: str) -> bool:
+        """Apply the window in Redis; the script is sent once, then by SHA."""
+        client = realtime.redis
+        script = self._script
+        if script is None or script.registered_client is not client:
+            self._script = client.register_script(SLIDING_WINDOW_SCRIPT)
         
-        # Clean old requests
-        if identifier in self.requests:
-            self.requests[identifier] = [
-                req_time for req_time in self.requests[identifier]
-                if current_time - req_time < self.window_seconds
+        now = time.time()
+        allowed = await self._script(
+            keys=[f"rl:{self.name}:{identifier}"],
+            args=[
+                now,
+                self.window_seconds,
+                self.max_requests,
+                f"{now}:{uuid.uuid4().hex}"
             ]
-        else:
-            self.requests[identifier] = []
+        )
+        return bool(allowed)
+    
+    def _is_allowed_local(self, identifier: str) -> bool:
+        """Apply a fixed window counter in process memory."""
+        current_time = time.monotonic()
+        if current_time >= self._next_sweep:
+            self._evict_expired(current_time)
+        
+        count, window_start = self.requests.get(identifier, (0, current_time))
+        if current_time - window_start >= self.window_seconds:
+            count, window_start = 0, current_time
         
         # Check if under limit
-        if len(self.requests[identifier]) >= self.max_requests:
+        if count >= self.max_requests:
             return False
         
-        # Add current request
-        self.requests[identifier].append(current_time)
+        self.requests[identifier] = (count + 1, window_start)
         return True
+    
+    def _evict_expired(self, current_time: float):
+        """Forget identifiers whose window has ended; at most once a window."""
+        self.requests = {
+            identifier: entry for identifier, entry in self.requests.items()
+            if current_time - entry[1] < self.window_seconds
+        }
+        self._next_sweep = current_time + self.window_seconds
 
 
 class SecurityMiddleware:
     """Security middleware for API protection."""
     
     def __init__(self):
-        self.rate_limiter = RateLimiter(max_requests=1000, window_seconds=3600)
-        self.chat_rate_limiter = RateLimiter(max_requests=100, window_seconds=3600)
+        self.rate_limiter = RateLimiter(
+            max_requests=1000, window_seconds=3600, name="global"
+        )
+        self.chat_rate_limiter = RateLimiter(
+            max_requests=100, window_seconds=3600, name="chat"
+        )
     
     async def __call__(self, request: Request, call_next):
         """Process request through security checks."""
@@ -53,22 +124,13 @@ class SecurityMiddleware:
         client_ip = self.get_client_ip(request)
         
         # Apply rate limiting
-        if not self.rate_limiter.is_allowed(client_ip):
+        if not await self.rate_limiter.is_allowed(client_ip):
             logger.warning("Rate limit exceeded", client_ip=client_ip, path=request.url.path)
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Rate limit exceeded. Please try again later."
             )
         
-        # Special rate limiting for chat endpoints
-        if "/chat" in request.url.path:
-            if not self.chat_rate_limiter.is_allowed(client_ip):
-                logger.warning("Chat rate limit exceeded", client_ip=client_ip)
-                raise HTTPException(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    detail="Chat rate limit exceeded. Please slow down."
-                )
-        
         # Add security headers
         response = await call_next(request)
         
@@ -79,6 +141,16 @@ class SecurityMiddleware:
         
         return response
     
+    async def check_chat_rate_limit(self, request: Request):
+        """Apply the stricter chat rate limit; a dependency of chat routes."""
+        client_ip = self.get_client_ip(request)
+        if not await self.chat_rate_limiter.is_allowed(client_ip):
+            logger.warning("Chat rate limit exceeded", client_ip=client_ip)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Chat rate limit exceeded. Please slow down."
+            )
+    
     def get_client_ip(self, request: Request) -> str:
         """Extract client IP from request."""
         # Check for forwarded headers (when behind proxy)
@@ -118,17 +190,37 @@ class APIKeyAuth(HTTPBearer):
         )
 
 
+# Characters counted as the "special" class in password strength checks
+_SPECIAL_CHARS = frozenset("!@#$%^&*()_+-=[]{}|;:,.<>?")
+
+
 def validate_password_strength(password: str) -> bool:
     """Validate password strength."""
     if len(password) < 8:
         return False
     
-    has_upper = any(c.isupper() for c in password)
-    has_lower = any(c.islower() for c in password)
-    has_digit = any(c.isdigit() for c in password)
-    has_special = any(c in "!@#$%^&*()_+-=[]{}|;:,.<>?" for c in password)
+    # One pass collecting a bit per class: upper, lower, digit, special
+    classes = 0
+    for c in password:
+        if c.isupper():
+            classes |= 1
+        elif c.islower():
+            classes |= 2
+        elif c.isdigit():
+            classes |= 4
+        elif c in _SPECIAL_CHARS:
+            classes |= 8
+        if classes == 15:
+            break
     
-    return sum([has_upper, has_lower, has_digit, has_special]) >= 3
+    return bin(classes).count("1") >= 3
+
+
+# Translation table deleting ASCII control characters except tab, newline and
+# carriage return
+_CONTROL_CHARS = dict.fromkeys(
+    code for code in range(32) if chr(code) not in "\n\r\t"
+)
 
 
 def sanitize_input(text: str, max_length: int = 1000) -> str:
@@ -137,7 +229,7 @@ def sanitize_input(text: str, max_length: int = 1000) -> str:
         return ""
     
     # Remove null bytes and control characters
-    sanitized = "".join(char for char in text if ord(char) >= 32 or char in "\n\r\t")
+    sanitized = text.translate(_CONTROL_CHARS)
     
     # Truncate to max length
     if len(sanitized) > max_length:
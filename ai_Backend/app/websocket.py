@@ -1,84 +1,290 @@
 """
 WebSocket implementation for real-time chat functionality.
 """
-import json
-from typing import Dict, List, Optional
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
-from jose import JWTError, jwt
+import asyncio
+import contextlib
+import functools
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, DefaultDict, Dict, List, Optional, Tuple
+from weakref import WeakSet
+from fastapi import (
+    APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+)
+from starlette.websockets import WebSocketState
 from bson import ObjectId
+import orjson
+import ormsgpack
 import structlog
 
 from app.config import settings
 from app.models.user import User
 from app.ai.conversation_manager import conversation_manager
+from app.api.dependencies import authenticate_token
+from app.realtime import realtime, chat_channel, notification_channel
 
 logger = structlog.get_logger()
 
 websocket_router = APIRouter()
 
 
+# Clients that offer this subprotocol get binary MessagePack frames instead of
+# JSON text
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+
+def uses_msgpack(websocket: WebSocket) -> bool:
+    """Whether MessagePack was negotiated for this connection."""
+    return getattr(websocket.state, "msgpack", False)
+
+
+# Envelopes for the high-volume chat events; orjson and ormsgpack encode
+# slotted dataclasses directly, without building an intermediate dict per
+# event
+@dataclass(slots=True, kw_only=True)
+class AiDeltaEvent:
+    type: str = "ai_delta"
+    conversation_id: Optional[str]
+    chunk: str
+
+
+@dataclass(slots=True, kw_only=True)
+class MessageSentEvent:
+    type: str = "message_sent"
+    message_id: str
+    conversation_id: Optional[str]
+    content: str
+    timestamp: Any = None
+
+
+@dataclass(slots=True, kw_only=True)
+class AiResponseEvent:
+    type: str = "ai_response"
+    message_id: str
+    conversation_id: Optional[str]
+    content: str
+    metadata: Dict[str, Any]
+
+
+# Upper bounds for coalescing queued frames into a single write
+WS_BATCH_MAX_FRAMES = 128
+WS_BATCH_MAX_BYTES = 16 * 1024
+
+# Frames a client may fall behind by before its connection is dropped
+WS_OUTBOX_MAX_FRAMES = 1024
+
+
+def _encode(websocket: WebSocket, message) -> bytes:
+    """Encode a message in the connection's negotiated format."""
+    if uses_msgpack(websocket):
+        return ormsgpack.packb(message)
+    return orjson.dumps(message)
+
+
+def _join_frames(websocket: WebSocket, payloads: List[bytes]) -> bytes:
+    """Combine already-encoded messages into one array payload."""
+    if uses_msgpack(websocket):
+        count = len(payloads)
+        if count < 16:
+            header = bytes([0x90 | count])
+        else:
+            header = b"\xdc" + count.to_bytes(2, "big")
+        return header + b"".join(payloads)
+    return b"[" + b",".join(payloads) + b"]"
+
+
+async def _send_frame(websocket: WebSocket, payload: bytes):
+    """Write an encoded payload as a binary (MessagePack) or text frame."""
+    if uses_msgpack(websocket):
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload.decode())
+
+
+async def send_json(websocket: WebSocket, message):
+    """
+    Queue a message on the connection's outbox, or send it if it has none.
+    
+    Raises WebSocketDisconnect once the connection's writer has stopped, or
+    when the client has fallen WS_OUTBOX_MAX_FRAMES behind (the connection is
+    then dropped).
+    """
+    if not hasattr(websocket.state, "outbox"):
+        await _send_frame(websocket, _encode(websocket, message))
+        return
+    
+    outbox = websocket.state.outbox
+    if outbox is None:
+        raise WebSocketDisconnect(code=status.WS_1011_INTERNAL_ERROR)
+    
+    try:
+        outbox.put_nowait(message)
+    except asyncio.QueueFull:
+        logger.warning(
+            "WebSocket client too slow, dropping connection",
+            connection_id=websocket.state.connection_id
+        )
+        websocket.state.close_code = status.WS_1008_POLICY_VIOLATION
+        # Stops the writer, which closes the socket
+        manager.disconnect(websocket)
+        raise WebSocketDisconnect(code=status.WS_1008_POLICY_VIOLATION)
+
+
+async def receive_json(websocket: WebSocket):
+    """Receive and decode a message in the connection's negotiated format."""
+    if uses_msgpack(websocket):
+        return ormsgpack.unpackb(await websocket.receive_bytes())
+    return orjson.loads(await websocket.receive_text())
+
+
+async def write_outbox(websocket: WebSocket, outbox: asyncio.Queue):
+    """
+    Drain a connection's outbox in order.
+    
+    When BATCH_WS is set, bursts are coalesced into one frame.
+    """
+    try:
+        while True:
+            payloads = [_encode(websocket, await outbox.get())]
+            size = len(payloads[0])
+            while (
+                len(payloads) < WS_BATCH_MAX_FRAMES
+                and size < WS_BATCH_MAX_BYTES
+            ):
+                try:
+                    payload = _encode(websocket, outbox.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+                payloads.append(payload)
+                size += len(payload)
+            
+            if settings.batch_ws and len(payloads) > 1:
+                await _send_frame(websocket, _join_frames(websocket, payloads))
+                continue
+            
+            for payload in payloads:
+                await _send_frame(websocket, payload)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning("WebSocket writer stopped", error=str(e))
+    finally:
+        # Nothing can be sent any more: stop queueing, unregister and close
+        # the socket
+        websocket.state.outbox = None
+        manager.disconnect(websocket)
+        if (
+            websocket.application_state == WebSocketState.CONNECTED
+            and websocket.client_state == WebSocketState.CONNECTED
+        ):
+            with contextlib.suppress(Exception):
+                await websocket.close(code=getattr(
+                    websocket.state,
+                    "close_code",
+                    status.WS_1011_INTERNAL_ERROR
+                ))
+
+
 class ConnectionManager:
     """Manages WebSocket connections."""
     
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.user_connections: Dict[str, str] = {}  # user_id -> connection_id
+        # user_id -> that user's open sockets; closed sockets drop out on
+        # their own
+        self.user_connections: DefaultDict[str, WeakSet] = defaultdict(WeakSet)
+        self.connection_count = 0
     
-    async def connect(self, websocket: WebSocket, user_id: str, connection_id: str):
-        """Accept a new WebSocket connection."""
-        await websocket.accept()
-        self.active_connections[connection_id] = websocket
-        self.user_connections[user_id] = connection_id
+    async def connect(
+        self, 
+        websocket: WebSocket, 
+        user_id: str, 
+        channels: Tuple[str, ...] = (),
+        subprotocol: Optional[str] = None
+    ):
+        """Accept a new WebSocket connection and relay its pub/sub channels."""
+        await websocket.accept(subprotocol=subprotocol)
+        websocket.state.user_id = user_id
+        websocket.state.connection_id = uuid.uuid4().hex
+        self.user_connections[user_id].add(websocket)
+        self.connection_count += 1
+        
+        outbox = asyncio.Queue(maxsize=WS_OUTBOX_MAX_FRAMES)
+        websocket.state.outbox = outbox
+        websocket.state.tasks = [
+            asyncio.create_task(write_outbox(websocket, outbox))
+        ]
+        
+        # Relayed events go through the outbox, so they share its ordering,
+        # backpressure and the connection's encoding
+        subscription = await realtime.subscribe(
+            functools.partial(send_json, websocket), *channels
+        )
+        if subscription:
+            websocket.state.tasks.append(subscription)
         
         logger.info(
             "WebSocket connection established",
             user_id=user_id,
-            connection_id=connection_id,
-            total_connections=len(self.active_connections)
+            connection_id=websocket.state.connection_id,
+            total_connections=self.connection_count
         )
     
-    def disconnect(self, connection_id: str, user_id: Optional[str] = None):
+    def disconnect(self, websocket: WebSocket):
         """Remove a WebSocket connection."""
-        if connection_id in self.active_connections:
-            del self.active_connections[connection_id]
+        user_id = getattr(websocket.state, "user_id", None)
+        connections = self.user_connections.get(user_id)
+        if connections is None or websocket not in connections:
+            return
         
-        if user_id and user_id in self.user_connections:
+        connections.discard(websocket)
+        if not connections:
             del self.user_connections[user_id]
+        self.connection_count -= 1
+        
+        # The writer may be the caller, while it shuts down
+        current = asyncio.current_task()
+        for task in websocket.state.tasks:
+            if task is not current:
+                task.cancel()
         
         logger.info(
             "WebSocket connection closed",
             user_id=user_id,
-            connection_id=connection_id,
-            total_connections=len(self.active_connections)
+            connection_id=websocket.state.connection_id,
+            total_connections=self.connection_count
         )
     
     async def send_personal_message(self, message: dict, user_id: str):
-        """Send a message to a specific user."""
-        connection_id = self.user_connections.get(user_id)
-        if connection_id and connection_id in self.active_connections:
-            websocket = self.active_connections[connection_id]
+        """Send a message to every open connection of a specific user."""
+        sent = False
+        for websocket in list(self.user_connections.get(user_id, ())):
             try:
-                await websocket.send_text(json.dumps(message))
-                return True
+                await send_json(websocket, message)
+                sent = True
             except Exception as e:
                 logger.error("Failed to send WebSocket message", error=str(e), user_id=user_id)
-                self.disconnect(connection_id, user_id)
-                return False
-        return False
+                self.disconnect(websocket)
+        return sent
     
     async def broadcast(self, message: dict):
         """Broadcast a message to all connected clients."""
         disconnected = []
-        for connection_id, websocket in self.active_connections.items():
-            try:
-                await websocket.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error("Failed to broadcast message", error=str(e), connection_id=connection_id)
-                disconnected.append(connection_id)
+        for connections in list(self.user_connections.values()):
+            for websocket in list(connections):
+                try:
+                    await send_json(websocket, message)
+                except Exception as e:
+                    logger.error(
+                        "Failed to broadcast message",
+                        error=str(e),
+                        connection_id=websocket.state.connection_id
+                    )
+                    disconnected.append(websocket)
         
         # Clean up disconnected connections
-        for connection_id in disconnected:
-            self.disconnect(connection_id)
+        for websocket in disconnected:
+            self.disconnect(websocket)
 
 
 # Global connection manager
@@ -87,16 +293,8 @@ manager = ConnectionManager()
 
 async def get_user_from_token(token: str) -> Optional[User]:
     """Extract user from JWT token."""
-    try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            return None
-        
-        user = await User.get(ObjectId(user_id))
-        return user if user and user.is_active else None
-    except JWTError:
-        return None
+    user = await authenticate_token(token)
+    return user if user and user.is_active else None
 
 
 @websocket_router.websocket("/chat")
@@ -108,42 +306,53 @@ async def websocket_chat_endpoint(websocket: WebSocket, token: str):
         await websocket.close(code=4001, reason="Authentication failed")
         return
     
-    connection_id = f"{user.id}_{id(websocket)}"
+    # Negotiate MessagePack via Sec-WebSocket-Protocol; browsers keep JSON
+    subprotocol = None
+    if MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        subprotocol = MSGPACK_SUBPROTOCOL
+        websocket.state.msgpack = True
     
     try:
-        await manager.connect(websocket, str(user.id), connection_id)
+        await manager.connect(websocket, str(user.id), subprotocol=subprotocol)
         
         # Send welcome message
-        await websocket.send_text(json.dumps({
+        await send_json(websocket, {
             "type": "connection_established",
             "message": "Connected to AI chat",
             "user_id": str(user.id)
-        }))
+        })
         
         while True:
             # Receive message from client
-            data = await websocket.receive_text()
+            try:
+                message_data = await receive_json(websocket)
+            except (orjson.JSONDecodeError, ormsgpack.MsgpackDecodeError):
+                await send_json(websocket, {
+                    "type": "error",
+                    "message": "Invalid message format"
+                })
+                continue
             
             try:
-                message_data = json.loads(data)
                 await handle_websocket_message(websocket, user, message_data)
-            except json.JSONDecodeError:
-                await websocket.send_text(json.dumps({
-                    "type": "error",
-                    "message": "Invalid JSON format"
-                }))
             except Exception as e:
                 logger.error("Error handling WebSocket message", error=str(e), user_id=str(user.id))
-                await websocket.send_text(json.dumps({
+                await send_json(websocket, {
                     "type": "error",
                     "message": "Failed to process message"
-                }))
+                })
     
     except WebSocketDisconnect:
-        manager.disconnect(connection_id, str(user.id))
+        manager.disconnect(websocket)
     except Exception as e:
         logger.error("WebSocket error", error=str(e), user_id=str(user.id))
-        manager.disconnect(connection_id, str(user.id))
+        manager.disconnect(websocket)
+
+
+async def send_events(websocket: WebSocket, events: List[Any]):
+    """Queue several events together so the writer flushes them in one go."""
+    for event in events:
+        await send_json(websocket, event)
 
 
 async def handle_websocket_message(websocket: WebSocket, user: User, message_data: dict):
@@ -155,12 +364,12 @@ async def handle_websocket_message(websocket: WebSocket, user: User, message_dat
     elif message_type == "typing":
         await handle_typing_indicator(websocket, user, message_data)
     elif message_type == "ping":
-        await websocket.send_text(json.dumps({"type": "pong"}))
+        await send_json(websocket, {"type": "pong"})
     else:
-        await websocket.send_text(json.dumps({
+        await send_json(websocket, {
             "type": "error",
             "message": f"Unknown message type: {message_type}"
-        }))
+        })
 
 
 async def handle_chat_message(websocket: WebSocket, user: User, message_data: dict):
@@ -170,17 +379,17 @@ async def handle_chat_message(websocket: WebSocket, user: User, message_data: di
         conversation_id = message_data.get("conversation_id")
         
         if not content:
-            await websocket.send_text(json.dumps({
+            await send_json(websocket, {
                 "type": "error",
                 "message": "Message content cannot be empty"
-            }))
+            })
             return
         
         # Send typing indicator
-        await websocket.send_text(json.dumps({
+        await send_json(websocket, {
             "type": "ai_typing",
             "conversation_id": conversation_id
-        }))
+        })
         
         # Convert conversation_id if provided
         conv_id = None
@@ -188,36 +397,44 @@ async def handle_chat_message(websocket: WebSocket, user: User, message_data: di
             try:
                 conv_id = ObjectId(conversation_id)
             except Exception:
-                await websocket.send_text(json.dumps({
+                await send_json(websocket, {
                     "type": "error",
                     "message": "Invalid conversation ID"
-                }))
+                })
                 return
         
-        # Process the message
+        async def send_delta(chunk: str):
+            await send_json(websocket, AiDeltaEvent(
+                conversation_id=conversation_id, chunk=chunk
+            ))
+        
+        # Process the message, streaming the reply as it is generated
         result = await conversation_manager.process_user_message(
             conversation_id=conv_id,
             user_message=content,
-            user_id=user.id
+            user_id=user.id,
+            on_chunk=send_delta
         )
         
-        # Send user message confirmation
-        await websocket.send_text(json.dumps({
-            "type": "message_sent",
-            "message_id": result["user_message_id"],
-            "conversation_id": str(conv_id) if conv_id else result.get("conversation_id"),
-            "content": content,
-            "timestamp": message_data.get("timestamp")
-        }))
-        
-        # Send AI response
-        await websocket.send_text(json.dumps({
-            "type": "ai_response",
-            "message_id": result["ai_message_id"],
-            "conversation_id": str(conv_id) if conv_id else result.get("conversation_id"),
-            "content": result["response"],
-            "metadata": result["metadata"]
-        }))
+        # Send user message confirmation and AI response
+        if conv_id:
+            response_conversation_id = str(conv_id)
+        else:
+            response_conversation_id = result.get("conversation_id")
+        await send_events(websocket, [
+            MessageSentEvent(
+                message_id=result["user_message_id"],
+                conversation_id=response_conversation_id,
+                content=content,
+                timestamp=message_data.get("timestamp")
+            ),
+            AiResponseEvent(
+                message_id=result["ai_message_id"],
+                conversation_id=response_conversation_id,
+                content=result["response"],
+                metadata=result["metadata"]
+            )
+        ])
         
         logger.info(
             "WebSocket chat message processed",
@@ -228,10 +445,10 @@ async def handle_chat_message(websocket: WebSocket, user: User, message_data: di
         
     except Exception as e:
         logger.error("Failed to process WebSocket chat message", error=str(e), user_id=str(user.id))
-        await websocket.send_text(json.dumps({
+        await send_json(websocket, {
             "type": "error",
             "message": "Failed to process your message. Please try again."
-        }))
+        })
 
 
 async def handle_typing_indicator(websocket: WebSocket, user: User, message_data: dict):
@@ -239,13 +456,13 @@ async def handle_typing_indicator(websocket: WebSocket, user: User, message_data
     conversation_id = message_data.get("conversation_id")
     is_typing = message_data.get("is_typing", False)
     
-    # For now, just acknowledge the typing indicator
-    # In a multi-user chat, you would broadcast this to other participants
-    await websocket.send_text(json.dumps({
-        "type": "typing_acknowledged",
+    # Fan out to the user's other connections, on any worker
+    await realtime.publish(chat_channel(str(user.id)), {
+        "type": "typing",
         "conversation_id": conversation_id,
+        "user_id": str(user.id),
         "is_typing": is_typing
-    }))
+    })
 
 
 @websocket_router.websocket("/notifications")
@@ -256,15 +473,20 @@ async def websocket_notifications_endpoint(websocket: WebSocket, token: str):
         await websocket.close(code=4001, reason="Authentication failed")
         return
     
-    connection_id = f"notif_{user.id}_{id(websocket)}"
-    
     try:
-        await manager.connect(websocket, str(user.id), connection_id)
+        await manager.connect(
+            websocket,
+            str(user.id),
+            channels=(
+                notification_channel(str(user.id)),
+                chat_channel(str(user.id))
+            )
+        )
         
-        await websocket.send_text(json.dumps({
+        await send_json(websocket, {
             "type": "notifications_connected",
             "message": "Connected to notifications"
-        }))
+        })
         
         # Keep connection alive
         while True:
@@ -274,7 +496,7 @@ async def websocket_notifications_endpoint(websocket: WebSocket, token: str):
                 await websocket.send_text("pong")
     
     except WebSocketDisconnect:
-        manager.disconnect(connection_id, str(user.id))
+        manager.disconnect(websocket)
     except Exception as e:
         logger.error("Notifications WebSocket error", error=str(e), user_id=str(user.id))
-        manager.disconnect(connection_id, str(user.id))
+        manager.disconnect(websocket)
@@ -5,6 +5,8 @@ This demonstrates how to interact with the backend from a Python client.
 """
 import asyncio
 import json
+import orjson
+import ormsgpack
 import websockets
 from httpx import AsyncClient
 
@@ -94,18 +96,24 @@ class AIBackendClient:
         response.raise_for_status()
         return response.json()
     
-    async def websocket_chat(self, on_message_callback=None):
-        """Connect to WebSocket for real-time chat."""
+    async def websocket_chat(self, on_message_callback=None, use_msgpack: bool = False):
+        """Connect to WebSocket for real-time chat.
+        
+        With use_msgpack the server sends and expects binary MessagePack frames.
+        """
         if not self.token:
             raise ValueError("Not authenticated. Please login first.")
         
         uri = f"{self.ws_url}/ws/chat?token={self.token}"
+        subprotocols = ["msgpack"] if use_msgpack else None
+        encode = ormsgpack.packb if use_msgpack else json.dumps
+        decode = ormsgpack.unpackb if use_msgpack else orjson.loads
         
-        async with websockets.connect(uri) as websocket:
+        async with websockets.connect(uri, subprotocols=subprotocols) as websocket:
             print("Connected to WebSocket chat")
             
             # Send a test message
-            await websocket.send(json.dumps({
+            await websocket.send(encode({
                 "type": "chat_message",
                 "content": "Hello from WebSocket!",
                 "conversation_id": None
@@ -113,11 +121,19 @@ class AIBackendClient:
             
             # Listen for messages
             async for message in websocket:
-                data = json.loads(message)
-                print(f"Received: {data}")
+                data = decode(message)
                 
-                if on_message_callback:
-                    await on_message_callback(data)
+                # Batched frames (BATCH_WS=true) carry a list of events
+                events = data if isinstance(data, list) else [data]
+                for event in events:
+                    if event.get("type") == "ai_delta":
+                        # Partial reply text; the complete reply follows as "ai_response"
+                        print(event["chunk"], end="", flush=True)
+                    else:
+                        print(f"Received: {event}")
+                    
+                    if on_message_callback:
+                        await on_message_callback(event)
 
 
 async def main():
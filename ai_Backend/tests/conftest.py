@@ -2,16 +2,99 @@
 Test configuration and fixtures.
 """
 import asyncio
+import os
+import pickle
+import tempfile
+from functools import lru_cache, wraps
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+import httpx
+import orjson
 import pytest
-from httpx import AsyncClient
+from asgi_lifespan import LifespanManager
+from httpx import ASGITransport, AsyncClient
 from fastapi.testclient import TestClient
-from motor.motor_asyncio import AsyncIOMotorClient
-from beanie import init_beanie
+from bson import ObjectId
 
-from app.main import app
-from app.config import settings
-from app.models.user import User
-from app.models.conversation import Conversation, Message
+# Point the app at a throwaway database, one per pytest-xdist worker so workers
+# never share data, and skip model loading; settings are read on import below
+XDIST_WORKER = os.environ.get("PYTEST_XDIST_WORKER", "main")
+TEST_DB_NAME = f"test_ai_conversations_{XDIST_WORKER}"
+os.environ["DATABASE_NAME"] = TEST_DB_NAME
+os.environ.setdefault("LOAD_MODELS", "false")
+
+# Imported only now, so the settings see the environment set above
+from app.main import app  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.database import db  # noqa: E402
+from app.models.user import User, pwd_context  # noqa: E402
+from app.models.conversation import (  # noqa: E402
+    Conversation, ConversationStatus, Message
+)
+from app.ai.models import model_manager  # noqa: E402
+
+
+# Developer-only: set DEBUG_CACHING=1 to reuse pickled fixture data across runs
+DEBUG_CACHING = bool(os.environ.get("DEBUG_CACHING"))
+DEBUG_CACHE_DIR = Path(tempfile.gettempdir()) / "qbot-test-cache"
+
+
+def debug_caching(func):
+    """Pickle a fixture helper's result to disk and reuse it on later runs."""
+    if not DEBUG_CACHING:
+        return func
+    
+    path = DEBUG_CACHE_DIR / f"{func.__name__}.pkl"
+    
+    @wraps(func)
+    def wrapper():
+        if path.exists():
+            return pickle.loads(path.read_bytes())
+        result = func()
+        DEBUG_CACHE_DIR.mkdir(exist_ok=True)
+        # Write then rename, so parallel workers never read a partial file
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(pickle.dumps(result))
+        os.replace(tmp_path, path)
+        return result
+    
+    return wrapper
+
+
+_bcrypt_hash = pwd_context.hash
+_bcrypt_verify = pwd_context.verify
+
+
+@lru_cache(maxsize=None)
+def _memoized_hash(password: str) -> str:
+    return _bcrypt_hash(password)
+
+
+@lru_cache(maxsize=None)
+def _memoized_verify(password: str, hashed_password: str) -> bool:
+    return _bcrypt_verify(password, hashed_password)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def memoized_password_hashing():
+    """Run bcrypt once per distinct password for the whole session."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(pwd_context, "hash", _memoized_hash)
+        mp.setattr(pwd_context, "verify", _memoized_verify)
+        yield
+
+
+def _orjson_response_json(self: httpx.Response, **kwargs):
+    return orjson.loads(self.content)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def orjson_response_parsing():
+    """Parse test client responses with orjson instead of the json module."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(httpx.Response, "json", _orjson_response_json)
+        yield
 
 
 @pytest.fixture(scope="session")
@@ -23,55 +106,89 @@ def event_loop():
 
 
 @pytest.fixture(scope="session")
-async def test_db():
-    """Set up test database."""
-    # Use a test database
-    test_db_name = "test_ai_conversations"
-    client = AsyncIOMotorClient(settings.mongodb_url)
-    database = client[test_db_name]
-    
-    # Initialize Beanie with test database
-    await init_beanie(
-        database=database,
-        document_models=[User, Conversation, Message]
-    )
-    
-    yield database
+async def app_instance():
+    """Run the app's startup and shutdown once for the whole session."""
+    async with LifespanManager(app):
+        yield app
+
+
+@pytest.fixture(scope="session")
+async def test_db(app_instance):
+    """Test database, connected and initialized by the app's own startup."""
+    yield db.database
     
     # Clean up: drop test database
-    await client.drop_database(test_db_name)
-    client.close()
+    await db.client.drop_database(TEST_DB_NAME)
+    await db.disconnect()
 
 
-@pytest.fixture
-async def client(test_db):
-    """Create test client."""
-    async with AsyncClient(app=app, base_url="http://test") as ac:
+@pytest.fixture(scope="session")
+async def client(app_instance, test_db):
+    """Create one pooled test client shared by the whole session."""
+    # In-process ASGI calls, no sockets or server involved; the host must be
+    # one TrustedHostMiddleware allows
+    async with AsyncClient(
+        transport=ASGITransport(app=app_instance),
+        base_url="http://localhost",
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+    ) as ac:
         yield ac
 
 
 @pytest.fixture
 def sync_client():
     """Create synchronous test client."""
-    return TestClient(app)
+    return TestClient(app, base_url="http://localhost")
+
+
+STUB_AI_RESPONSE = "This is a stubbed AI response."
+
+# Tests that need real inference run only when the app loads its models
+requires_models = pytest.mark.skipif(
+    not settings.load_models,
+    reason="AI models are not loaded; set LOAD_MODELS=true to run"
+)
 
 
 @pytest.fixture
+def mock_ai_model(monkeypatch):
+    """Answer chat messages with a fixed reply instead of running the model."""
+    generate_response = AsyncMock(return_value=(
+        STUB_AI_RESPONSE,
+        {
+            "model_used": "stub",
+            "processing_time": 0.0,
+            "confidence_score": 1.0,
+            "tokens_used": 0
+        }
+    ))
+    monkeypatch.setattr(model_manager, "generate_response", generate_response)
+    return generate_response
+
+
+@debug_caching
+def _test_user_fields() -> dict:
+    """Fields of the test user, including its bcrypt hash."""
+    return {
+        "id": ObjectId(),
+        "email": "test@example.com",
+        "username": "testuser",
+        "full_name": "Test User",
+        "hashed_password": User.hash_password("testpassword123")
+    }
+
+
+@pytest.fixture(scope="session")
 async def test_user(test_db):
-    """Create a test user."""
-    user = User(
-        email="test@example.com",
-        username="testuser",
-        full_name="Test User",
-        hashed_password=User.hash_password("testpassword123")
-    )
+    """Create the test user once for the whole session."""
+    user = User(**_test_user_fields())
     await user.insert()
     return user
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 async def authenticated_headers(test_user):
-    """Get authentication headers for test user."""
+    """Sign one access token for the test user, shared by the whole session."""
     from app.api.routes.users import create_access_token
     from datetime import timedelta
     
@@ -94,6 +211,27 @@ async def test_conversation(test_user, test_db):
     return conversation
 
 
+@pytest.fixture
+def conv_paths(test_conversation):
+    """API paths for the test conversation, formatted once."""
+    conversation_id = str(test_conversation.id)
+    detail = f"/api/v1/conversations/{conversation_id}"
+    return SimpleNamespace(
+        id=conversation_id,
+        detail=detail,
+        archive=f"{detail}/archive",
+        restore=f"{detail}/restore"
+    )
+
+
+@pytest.fixture
+async def archived_conversation(test_conversation):
+    """The test conversation, already archived."""
+    test_conversation.status = ConversationStatus.ARCHIVED
+    await test_conversation.save()
+    return test_conversation
+
+
 @pytest.fixture
 async def test_message(test_conversation, test_db):
     """Create a test message."""
@@ -107,11 +245,15 @@ async def test_message(test_conversation, test_db):
 
 
 @pytest.fixture(autouse=True)
-async def cleanup_db(test_db):
+async def cleanup_db(test_db, test_user):
     """Clean up database after each test."""
     yield
     
-    # Clean up all collections
-    await User.delete_all()
-    await Conversation.delete_all()
-    await Message.delete_all()
+    # Empty the collections (schema and indexes stay from session setup),
+    # keeping the session's test user but undoing any change a test made to it
+    await asyncio.gather(
+        User.find(User.id != test_user.id).delete(),
+        test_user.replace(),
+        Conversation.delete_all(),
+        Message.delete_all()
+    )
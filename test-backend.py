@@ -5,13 +5,30 @@ This is a basic test server to verify the frontend integration works.
 Replace this with your actual AI backend.
 """
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from typing import List, Optional
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+import asyncio
+import os
+import re
 import time
 import random
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+app = FastAPI(default_response_class=ORJSONResponse)  # Serialize responses with orjson
+app.add_middleware(  # Enable CORS for all routes
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Set SIMULATE_LATENCY=1 to add a 0.5-2s delay to chat replies
+SIMULATE_LATENCY = bool(os.environ.get("SIMULATE_LATENCY"))
+
+# Private RNG instance for response picking and simulated latency
+_rng = random.Random()
 
 # Simple responses for testing
 TEST_RESPONSES = [
@@ -25,62 +42,74 @@ TEST_RESPONSES = [
     "That's a thoughtful inquiry. Let me provide you with some insights.",
 ]
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
+# Canned replies for keywords; one precompiled pattern finds the first keyword
+KEYWORD_RESPONSES = {
+    "hello": "Hello! Nice to meet you. I'm your AI assistant.",
+    "hi": "Hello! Nice to meet you. I'm your AI assistant.",
+    "how are you": "I'm doing great, thank you for asking! How can I assist you today?",
+    "test": "Test successful! The AI backend is working correctly.",
+    "bye": "Goodbye! Feel free to come back anytime you need assistance.",
+    "goodbye": "Goodbye! Feel free to come back anytime you need assistance.",
+}
+KEYWORD_PATTERN = re.compile(
+    r"\b(" + "|".join(map(re.escape, KEYWORD_RESPONSES)) + r")\b", re.IGNORECASE
+)
+
+class ChatIn(BaseModel):
+    """Chat request body"""
+    message: str = ""
+    conversation_history: List = []
+
+@app.get('/api/health')
+async def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return {
         "status": "healthy",
         "message": "AI Backend is running",
-        "timestamp": time.time()
-    })
+        "timestamp": time.time_ns() / 1e9
+    }
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
+@app.post('/api/chat')
+async def chat(data: Optional[ChatIn] = None):
     """Main chat endpoint"""
     try:
-        data = request.get_json()
-        
         if not data:
-            return jsonify({"error": "No data provided"}), 400
+            return ORJSONResponse({"error": "No data provided"}, status_code=400)
         
-        user_message = data.get('message', '')
-        conversation_history = data.get('conversation_history', [])
+        user_message = data.message
+        conversation_history = data.conversation_history
         
         if not user_message:
-            return jsonify({"error": "No message provided"}), 400
+            return ORJSONResponse({"error": "No message provided"}, status_code=400)
         
-        # Simulate processing time
-        time.sleep(random.uniform(0.5, 2.0))
+        # Simulate processing time, only when asked for
+        if SIMULATE_LATENCY:
+            await asyncio.sleep(_rng.uniform(0.5, 2.0))
         
         # Simple response logic for testing
-        if 'hello' in user_message.lower() or 'hi' in user_message.lower():
-            response = "Hello! Nice to meet you. I'm your AI assistant."
-        elif 'how are you' in user_message.lower():
-            response = "I'm doing great, thank you for asking! How can I assist you today?"
-        elif 'test' in user_message.lower():
-            response = "Test successful! The AI backend is working correctly."
-        elif 'bye' in user_message.lower() or 'goodbye' in user_message.lower():
-            response = "Goodbye! Feel free to come back anytime you need assistance."
+        match = KEYWORD_PATTERN.search(user_message)
+        if match:
+            response = KEYWORD_RESPONSES[match.group(1).lower()]
         else:
             # Random response for other messages
-            response = random.choice(TEST_RESPONSES)
+            response = _rng.choice(TEST_RESPONSES)
         
-        return jsonify({
+        return {
             "response": response,
-            "timestamp": time.time(),
+            "timestamp": time.time_ns() / 1e9,
             "message_count": len(conversation_history) + 1
-        })
+        }
         
     except Exception as e:
-        return jsonify({"error": f"Server error: {str(e)}"}), 500
+        return ORJSONResponse({"error": f"Server error: {str(e)}"}, status_code=500)
 
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
+@app.post('/api/upload')
+async def upload_file():
     """File upload endpoint (placeholder)"""
-    return jsonify({
+    return {
         "message": "File upload endpoint - not implemented yet",
         "status": "placeholder"
-    })
+    }
 
 if __name__ == '__main__':
     print("🤖 Starting Q-bot AI Backend Test Server...")
@@ -89,8 +118,14 @@ if __name__ == '__main__':
     print("💡 This is a test server. Replace with your actual AI backend.")
     print("🚀 Starting server...")
 
-    app.run(
+    import uvicorn
+    # uvloop and httptools are picked up automatically when installed
+    # (pip install "uvicorn[standard]"); per-request access logging is off
+    uvicorn.run(
+        app,
         host='0.0.0.0',
         port=8001,
-        debug=True
+        loop='auto',
+        http='auto',
+        access_log=False
     )